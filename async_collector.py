@@ -0,0 +1,246 @@
+"""
+Asyncio collection engine that collects the Meraki and the Catalyst Center
+datasets at the same time. Meraki is collected with the async client of the
+Meraki SDK and Catalyst Center with aiohttp towards its REST API. The rows
+are built with the same functions as in backend.py, so the output format is
+identical to the blocking collection.
+"""
+import os
+import time
+import asyncio
+import logging
+
+import aiohttp
+from meraki.aio import AsyncDashboardAPI
+from meraki.exceptions import AsyncAPIError
+
+import backend
+
+MERAKI_CONCURRENCY = int(os.getenv("MERAKI_CONCURRENCY", "8")) # Parallel Meraki requests
+CC_CONCURRENCY = backend.CC_MAX_WORKERS # Parallel Catalyst Center requests
+
+# Catalyst Center
+async def get_cc_token(http: aiohttp.ClientSession, base_url: str) -> str:
+    """
+    Retrieves an authentication token from Catalyst Center.
+    """
+    async with http.post(
+        f"{base_url}/dna/system/api/v1/auth/token",
+        auth=aiohttp.BasicAuth(backend.CC_USERNAME, backend.CC_PASSWORD),
+    ) as response:
+        response.raise_for_status()
+        data = await response.json()
+    return data["Token"]
+
+async def cc_get(http: aiohttp.ClientSession, url: str, token: str,
+                 semaphore: asyncio.Semaphore) -> dict:
+    """
+    GET request towards Catalyst Center, limited by the platform semaphore.
+    Rate limited (HTTP 429) requests are retried with backoff.
+    """
+    for attempt in range(backend.MAX_RETRIES + 1):
+        async with semaphore:
+            async with http.get(url, headers={"X-Auth-Token": token}) as response:
+                if response.status != 429 or attempt == backend.MAX_RETRIES:
+                    response.raise_for_status()
+                    return await response.json()
+                delay = float(response.headers.get("Retry-After", 2 ** attempt))
+        logging.warning("Rate limited by Catalyst Center, retrying in %s s", delay)
+        await asyncio.sleep(delay)
+
+async def build_cc_dataset_async(concurrency: int = CC_CONCURRENCY) -> list:
+    """
+    Builds the Catalyst Center dataset. The PoE details of all switches are
+    requested concurrently, at most `concurrency` at a time.
+    """
+    base_url = f"https://{backend.CC_HOST}:443"
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(ssl=False, limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as http:
+        token = await get_cc_token(http, base_url)
+
+        cache = backend.INVENTORY_CACHE
+        found, topology_data = cache.lookup("topology", backend.CC_HOST)
+        if not found:
+            topology = await cc_get(
+                http, f"{base_url}/dna/intent/api/v1/topology/physical-topology", token, semaphore
+            )
+            topology_data = (topology["response"]["nodes"], topology["response"]["links"])
+            cache.put("topology", backend.CC_HOST, topology_data)
+        # The mapping is only rebuilt from a new topology, incrementally when
+        # CC_INCREMENTAL_MAPPING is set
+        found_mapping, mapping = cache.lookup("cc_mapping", backend.CC_HOST)
+        if not found or not found_mapping:
+            mapping = backend.create_cc_data_mapping(None, topology_data=topology_data)
+            cache.put("cc_mapping", backend.CC_HOST, mapping)
+        switch_uuids = list({item["switch_deviceUuid"] for item in mapping})
+
+        async def get_poe_details(device_uuid):
+            url = f"{base_url}/dna/intent/api/v1/network-device/{device_uuid}/interface/poe-detail"
+            try:
+                return await cc_get(http, url, token, semaphore)
+            except aiohttp.ClientError as e:
+                logging.error("Failed to get PoE interface details from CC: %s", e)
+                return None
+
+        responses = await asyncio.gather(
+            *(get_poe_details(device_uuid) for device_uuid in switch_uuids)
+        )
+
+    poe_table = backend.poe_table_from_responses(switch_uuids, responses)
+    return backend.cc_rows(mapping, poe_table)
+
+# Meraki
+async def get_meraki_inventory(dashboard: AsyncDashboardAPI) -> tuple:
+    """
+    Returns the organization ID, the network IDs and the access devices,
+    using the inventory cache of the backend. Returns None if the organization
+    or the networks are not found.
+    """
+    cache = backend.INVENTORY_CACHE
+    inventory_key = (backend.ORG, tuple(backend.NETWORKS))
+
+    found, organization_id = cache.lookup("organization", backend.ORG)
+    if not found:
+        my_orgs = await dashboard.organizations.getOrganizations()
+        organization_id = next(
+            (item["id"] for item in my_orgs if item["name"] == backend.ORG), None
+        )
+        if organization_id is None:
+            logging.error("Meraki organization %s not found", backend.ORG)
+            return None
+        cache.put("organization", backend.ORG, organization_id)
+
+    found, network_ids = cache.lookup("networks", inventory_key)
+    if not found:
+        networks = await dashboard.organizations.getOrganizationNetworks(
+            organization_id, total_pages="all"
+        )
+        network_ids = [network["id"] for network in networks
+                       if network["name"] in backend.NETWORKS]
+        cache.put("networks", inventory_key, network_ids)
+    if not network_ids:
+        return None
+
+    found, access_data = cache.lookup("devices", inventory_key)
+    if not found:
+        devices_data = await dashboard.organizations.getOrganizationDevices(
+            organization_id, total_pages="all", networkIds=network_ids
+        )
+        access_data = backend.access_devices_from(devices_data)
+        cache.put("devices", inventory_key, access_data)
+
+    return organization_id, network_ids, access_data
+
+async def get_organization_port_statuses_async(dashboard: AsyncDashboardAPI,
+                                               organization_id: str, network_ids: list) -> dict:
+    """
+    Async version of backend.get_organization_port_statuses: pages through
+    the organization-wide port statuses endpoint with the REST session of
+    the async client. Returns a dictionary of switch serial -> port statuses.
+    """
+    metadata, url, params = backend.port_statuses_request(organization_id, network_ids)
+    statuses = {}
+    while url:
+        async with await dashboard._session.request(
+            metadata, "GET", url, params=params
+        ) as response:
+            statuses.update(backend.port_statuses_by_switch(await response.json(content_type=None)))
+            next_link = response.links.get("next")
+        # The next page link already carries the query parameters
+        url, params = (str(next_link["url"]) if next_link else None), None
+    return statuses
+
+async def get_switch_port_statuses(dashboard: AsyncDashboardAPI, serial: str) -> list:
+    """
+    Port statuses of a single switch. A failing switch is logged and left
+    out instead of failing the whole dataset.
+    """
+    try:
+        return await dashboard.switch.getDeviceSwitchPortsStatuses(serial=serial, timespan=3600)
+    except (aiohttp.ClientError, AsyncAPIError, asyncio.TimeoutError) as e:
+        logging.error("Failed to get Meraki switchport data of %s: %s", serial, e)
+        return []
+
+async def build_meraki_dataset_async(concurrency: int = MERAKI_CONCURRENCY) -> list:
+    """
+    Builds the Meraki dataset with the async Dashboard API client. The port
+    statuses of the switches are requested concurrently when the
+    organization-wide endpoint fails.
+    """
+    async with AsyncDashboardAPI(
+        backend.MERAKI_KEY,
+        print_console=False,
+        output_log=False,
+        maximum_concurrent_requests=concurrency,
+    ) as dashboard:
+        inventory = await get_meraki_inventory(dashboard)
+        if inventory is None:
+            return []
+        organization_id, network_ids, access_data = inventory
+
+        switch_devices = [access_device for access_device in access_data
+                          if "switch" in access_device["firmware"]]
+
+        try:
+            statuses = await get_organization_port_statuses_async(
+                dashboard, organization_id, network_ids
+            )
+            port_statuses = [statuses.get(device["serial"], []) for device in switch_devices]
+        except (aiohttp.ClientError, AsyncAPIError, asyncio.TimeoutError, KeyError) as e:
+            logging.warning("Organization-wide switch port statuses failed, "
+                            "requesting every switch: %s", e)
+            port_statuses = await asyncio.gather(
+                *(get_switch_port_statuses(dashboard, device["serial"])
+                  for device in switch_devices)
+            )
+
+    ap_index = backend.build_ap_index(access_data)
+    data_list = []
+    for switch_device, switch_port_statuses in zip(switch_devices, port_statuses):
+        data_list.extend(backend.meraki_rows(switch_device, ap_index, switch_port_statuses))
+    return data_list
+
+# Engine
+async def collect_platform(name: str, coroutine) -> list:
+    """
+    Awaits the collection of one platform. A failing platform is logged and
+    returns an empty dataset, so that it doesn't stop the other one.
+    """
+    try:
+        return await coroutine
+    except (aiohttp.ClientError, AsyncAPIError, asyncio.TimeoutError) as e:
+        logging.error("Failed to collect %s dataset: %s", name, e)
+        return []
+    except Exception: # Unexpected data must not discard the other platform's rows
+        logging.exception("Failed to collect %s dataset", name)
+        return []
+
+async def collect_combined_dataset(meraki_concurrency: int = MERAKI_CONCURRENCY,
+                                   cc_concurrency: int = CC_CONCURRENCY) -> list:
+    """
+    Collects the Meraki and the Catalyst Center datasets at the same time and
+    returns them in the same format as way1.combined_dataset.
+    """
+    meraki_dataset, cc_dataset = await asyncio.gather(
+        collect_platform("meraki", build_meraki_dataset_async(meraki_concurrency)),
+        collect_platform("catalyst center", build_cc_dataset_async(cc_concurrency)),
+    )
+    timestamp = time.time()
+
+    logging.info("Timestamp of when the data was collected: %s", timestamp)
+
+    for item in meraki_dataset:
+        item["timestamp"] = timestamp
+    for item in cc_dataset:
+        item["timestamp"] = timestamp
+
+    return [{"cc": cc_dataset, "meraki": meraki_dataset}]
+
+def combined_dataset_async(meraki_concurrency: int = MERAKI_CONCURRENCY,
+                           cc_concurrency: int = CC_CONCURRENCY) -> list:
+    """
+    Blocking entry point that runs one asyncio collection cycle.
+    """
+    return asyncio.run(collect_combined_dataset(meraki_concurrency, cc_concurrency))
@@ -3,14 +3,24 @@ This is the backend script where all API calls are defined and where the data ma
 takes place when using scripts way1.py and way2.py.
 """
 import os
+import re
+import time
 import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
 from dotenv import load_dotenv
 import requests
 
 from pprint import pprint
 
 from dnacentersdk import DNACenterAPI
+from dnacentersdk.exceptions import ApiError
 from meraki import DashboardAPI
+from meraki.exceptions import APIError as MerakiAPIError
+
+from sessions import get_cc_session, get_meraki_session
 
 load_dotenv()
 
@@ -20,18 +30,164 @@ CC_HOST = os.getenv("CC_HOST")
 MERAKI_KEY = os.getenv("MERAKI_DASHBOARD_API_KEY")
 ORG = "Meraki Nordics Lab" #Input your organization name
 NETWORKS = ["Cisco Live Energy Mgmt Demo"] # Your network name
+CC_MAX_WORKERS = int(os.getenv("CC_MAX_WORKERS", "8")) # Parallel PoE requests
+CC_REQUESTS_PER_SECOND = float(os.getenv("CC_REQUESTS_PER_SECOND", "5")) # CC API rate limit
+MERAKI_REQUESTS_PER_SECOND = float(os.getenv("MERAKI_REQUESTS_PER_SECOND", "10")) # Per organization
+MAX_RETRIES = 5 # Retries of a rate limited (HTTP 429) request
+CC_TASK_TIMEOUT = float(os.getenv("CC_TASK_TIMEOUT", "300")) # Seconds to wait for CC tasks
+CC_TASK_POLL_INTERVALS = (0.5, 10) # Min and max seconds between polls of CC tasks
+MERAKI_BATCH_SIZES = {True: 20, False: 100} # Actions per synchronous / asynchronous batch
+MERAKI_MAX_PENDING_BATCHES = 5 # Unfinished asynchronous batches allowed per organization
+MERAKI_BATCH_TIMEOUT = float(os.getenv("MERAKI_BATCH_TIMEOUT", "300")) # Seconds to wait for batches
+MERAKI_PORT_STATUSES_PER_PAGE = 20 # Switches per page of the port statuses endpoint (max 20)
+CC_INCREMENTAL_MAPPING = os.getenv("CC_INCREMENTAL_MAPPING", "false").lower() == "true"
+INVENTORY_TTLS = { # Seconds before inventory data is fetched again
+    "organization": 24 * 3600,
+    "networks": 3600,
+    "devices": 900,
+    "topology": 900,
+    "cc_mapping": 900,
+}
+MAC_ADDRESS = re.compile(
+    r"^([0-9a-fA-F]{2}([:-]?)[0-9a-fA-F]{2}(\2[0-9a-fA-F]{2}){4}"
+    r"|[0-9a-fA-F]{4}\.[0-9a-fA-F]{4}\.[0-9a-fA-F]{4})$"
+)
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter. Every request takes one token and
+    tokens are refilled at the given rate, up to the bucket capacity.
+    """
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    Checks if an API error is a rate limit (HTTP 429) response.
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status == 429
+
+def call_with_backoff(api_call, *args, rate_limiter: TokenBucket = None, **kwargs):
+    """
+    Calls an API function, waiting for the rate limiter first. Rate limited
+    calls are retried with exponential backoff, or after the Retry-After time
+    when the server provides one.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return api_call(*args, **kwargs)
+        except (ApiError, MerakiAPIError) as e:
+            if not is_rate_limited(e) or attempt == MAX_RETRIES:
+                raise
+            delay = getattr(e, "retry_after", None) or 2 ** attempt
+            logging.warning("Rate limited by the API, retrying in %s s", delay)
+            time.sleep(delay)
+
+class InventoryCache:
+    """
+    Thread safe cache for slow-changing inventory data (organization, networks,
+    devices, topology). Every data class has its own time to live in seconds
+    and its own hit and miss counters.
+    """
+    def __init__(self, ttls: dict):
+        self.ttls = ttls
+        self.hits = Counter()
+        self.misses = Counter()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, data_class: str, key) -> tuple:
+        """
+        Returns (True, value) for a fresh cache entry, otherwise (False, None).
+        """
+        with self._lock:
+            entry = self._entries.get((data_class, key))
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits[data_class] += 1
+                return True, entry[0]
+            self.misses[data_class] += 1
+            return False, None
+
+    def put(self, data_class: str, key, value) -> None:
+        """
+        Stores a value for the time to live of its data class.
+        """
+        with self._lock:
+            expires = time.monotonic() + self.ttls.get(data_class, 0)
+            self._entries[(data_class, key)] = (value, expires)
+
+    def get(self, data_class: str, key, loader):
+        """
+        Returns the cached value, or calls loader() and caches its result.
+        Failed lookups (None) are not cached.
+        """
+        found, value = self.lookup(data_class, key)
+        if found:
+            return value
+        value = loader()
+        if value is not None:
+            self.put(data_class, key, value)
+        return value
+
+    def items(self) -> list:
+        """
+        Returns all cached entries as (data class, key, value) tuples.
+        """
+        with self._lock:
+            return [(data_class, key, entry[0])
+                    for (data_class, key), entry in self._entries.items()]
+
+    def invalidate(self, data_class: str = None) -> None:
+        """
+        Drops all cache entries of a data class, or the whole cache.
+        """
+        with self._lock:
+            for entry_key in list(self._entries):
+                if data_class is None or entry_key[0] == data_class:
+                    del self._entries[entry_key]
+
+    def stats(self) -> dict:
+        """
+        Hit and miss counters per data class.
+        """
+        with self._lock:
+            return {data_class: {"hits": self.hits[data_class],
+                                 "misses": self.misses[data_class]}
+                    for data_class in set(self.hits) | set(self.misses)}
+
+INVENTORY_CACHE = InventoryCache(INVENTORY_TTLS)
 
 # Cisco CC backend
 def initiate_cc_session() -> DNACenterAPI:
     """
-    Returns an instance of the DNACenterAPI class from dnacentersdk
+    Returns the shared DNACenterAPI client of CC_HOST from the session registry
     """
     try:
-        catalystcenter = DNACenterAPI(
-            base_url=f"https://{CC_HOST}:443",
-            username=CC_USERNAME,
-            password=CC_PASSWORD,
-            verify=False,
+        catalystcenter = get_cc_session(
+            f"https://{CC_HOST}:443", CC_USERNAME, CC_PASSWORD, verify=False
         )
         return catalystcenter
     except (requests.exceptions.RequestException, ValueError) as e:
@@ -39,6 +195,15 @@ def initiate_cc_session() -> DNACenterAPI:
         return None
 
 def get_physical_topology_nodes_links(session_c: DNACenterAPI) -> list:
+    """
+    Retrieves the whole physical topology of Catalyst Center from the inventory cache.
+    Output is a list with all nodes and links data.
+    """
+    return INVENTORY_CACHE.get(
+        "topology", CC_HOST, lambda: fetch_physical_topology(session_c)
+    )
+
+def fetch_physical_topology(session_c: DNACenterAPI) -> list:
     """
     Retrieves the whole physical topology of Catalyst Center.
     Output is a list with all nodes and links data.
@@ -54,16 +219,31 @@ def get_physical_topology_nodes_links(session_c: DNACenterAPI) -> list:
         logging.error("Failed to get physical topology nodes from CC: %s", e)
         return None
 
-def get_switch_info(nodes, switch_device_uuid):
+def build_topology_index(nodes: list, links: list) -> dict:
+    """
+    Indexes the physical topology in a single pass over nodes and links.
+    Returns a dictionary with a node-id -> node lookup ("nodes") and the
+    links attached to every node id ("adjacency").
+    """
+    nodes_by_id = {node["id"]: node for node in nodes}
+    adjacency = {}
+    for link in links:
+        adjacency.setdefault(link["source"], []).append(link)
+        if link["target"] != link["source"]:
+            adjacency.setdefault(link["target"], []).append(link)
+
+    return {"nodes": nodes_by_id, "adjacency": adjacency}
+
+def get_switch_info(nodes_by_id: dict, switch_device_uuid):
     """
     Retrieve switch label for a given switch device UUID.
     """
-    for item in nodes:
-        if item["id"] == switch_device_uuid:
-            return item["label"]
+    node = nodes_by_id.get(switch_device_uuid)
+    if node:
+        return node["label"]
     return None
 
-def process_link(link, nodes, ap_device_label, ap_device_uuid, ap_platform_id):
+def process_link(link, nodes_by_id, ap_device_label, ap_device_uuid, ap_platform_id):
     """
     Process a single link and return device mapping if applicable.
     """
@@ -76,7 +256,7 @@ def process_link(link, nodes, ap_device_label, ap_device_uuid, ap_platform_id):
     interface_name = (link.get("endPortName")
                       if link["source"] == ap_device_uuid
                       else link.get("startPortName"))
-    switch_label = get_switch_info(nodes, switch_device_uuid)
+    switch_label = get_switch_info(nodes_by_id, switch_device_uuid)
 
     if switch_label:  # Ensure switch_label is not None
         return {
@@ -90,46 +270,259 @@ def process_link(link, nodes, ap_device_label, ap_device_uuid, ap_platform_id):
         }
     return None
 
-def create_cc_data_mapping(session_c: DNACenterAPI) -> list:
+def map_ap(node: dict, nodes_by_id: dict, ap_links) -> list:
     """
-    This function returns a list of dictionaries with interfaceUuid, AP_Uuid and SW_Uuid data.
-    The data is retrieved by the Topology API of Cisco Catalyt Center.
-    It will return a list of dictionaries if successful, otherwise it returns an empty list.
+    Maps a single Access Point node to the switch ports of its links.
     """
-    topology_data = get_physical_topology_nodes_links(session_c)
-    nodes, links = topology_data
+    ap_device_uuid, ap_device_label, ap_platform_id = (node["id"],
+                                                       node["label"],
+                                                       node["platformId"])
+    return list(
+        filter(
+            None, [
+                process_link(
+                    link,
+                    nodes_by_id,
+                    ap_device_label,
+                    ap_device_uuid,
+                    ap_platform_id
+                    )
+                    for link in ap_links
+            ]
+        )
+    )
+
+def map_aps_to_switches(topology_index: dict) -> list:
+    """
+    Maps every Access Point in the indexed topology to the switch port it is
+    connected to. Runs in time linear to the number of nodes and links.
+    """
+    nodes_by_id = topology_index["nodes"]
+    adjacency = topology_index["adjacency"]
 
     mapping_list = []
-    for node in nodes:
+    for node in nodes_by_id.values():
         if "Unified AP" in node["family"]:
-            ap_device_uuid, ap_device_label, ap_platform_id = (node["id"],
-                                                               node["label"],
-                                                               node["platformId"])
             mapping_list.extend(
-                filter(
-                    None, [
-                        process_link(
-                            link,
-                            nodes,
-                            ap_device_label,
-                            ap_device_uuid,
-                            ap_platform_id
-                            )
-                            for link in links
-                            if ap_device_uuid in (link['source'], link['target'])
-                    ]
-                )
+                map_ap(node, nodes_by_id, adjacency.get(node["id"], []))
             )
+    return mapping_list
+
+def link_key(link: dict) -> tuple:
+    """
+    Identifies a topology link, by its id when Catalyst Center provides one.
+    """
+    if link.get("id"):
+        return (link["id"],)
+    return (link["source"], link["target"], link.get("startPortID"), link.get("endPortID"))
+
+def attachment(ap_mapping: list) -> set:
+    """
+    Switch ports an AP is connected to, according to its mapping rows.
+    """
+    return {(row["switch_deviceUuid"], row["interfaceUuid"]) for row in ap_mapping}
+
+class IncrementalMapper:
+    """
+    Keeps the AP to switch port mapping between polls. Every update diffs the
+    new topology nodes and links against the previous snapshot and remaps only
+    the APs touched by added, removed or changed nodes and links, so the
+    mapping cost scales with the churn instead of the size of the topology.
+    Updates are serialized, so the snapshot is never read while it changes.
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.links = {}
+        self.adjacency = {}
+        self.ap_mappings = {}
+        self.last_changes = {"new_aps": [], "moved_aps": [], "removed_aps": []}
+        self._lock = threading.Lock()
+
+    def update(self, nodes: list, links: list) -> tuple:
+        """
+        Applies a new topology. Returns the full mapping list and the change
+        set with the new, moved and removed AP ids.
+        """
+        with self._lock: # The inventory and collection jobs update it concurrently
+            new_nodes = {node["id"]: node for node in nodes}
+            new_links = {link_key(link): link for link in links}
+
+            changed_node_ids = {node_id for node_id, node in new_nodes.items()
+                                if self.nodes.get(node_id) != node}
+            changed_node_ids.update(node_id for node_id in self.nodes
+                                    if node_id not in new_nodes)
+            added_links = [key for key, link in new_links.items()
+                           if self.links.get(key) != link]
+            removed_links = [key for key in self.links
+                             if key not in new_links or self.links[key] != new_links[key]]
+
+            # Endpoints of changed links and neighbours of changed nodes need remapping
+            touched = set(changed_node_ids)
+            for key in removed_links:
+                link = self.links[key]
+                touched.update((link["source"], link["target"]))
+                for node_id in (link["source"], link["target"]):
+                    self.adjacency.get(node_id, {}).pop(key, None)
+            for key in added_links:
+                link = new_links[key]
+                touched.update((link["source"], link["target"]))
+                for node_id in (link["source"], link["target"]):
+                    self.adjacency.setdefault(node_id, {})[key] = link
+            for node_id in changed_node_ids:
+                for link in self.adjacency.get(node_id, {}).values():
+                    touched.update((link["source"], link["target"]))
+
+            self.nodes, self.links = new_nodes, new_links
+
+            changes = {"new_aps": [], "moved_aps": [], "removed_aps": []}
+            for node_id in touched:
+                previous = self.ap_mappings.pop(node_id, None)
+                node = new_nodes.get(node_id)
+                current = None
+                if node is not None and "Unified AP" in node["family"]:
+                    current = map_ap(node, new_nodes, self.adjacency.get(node_id, {}).values())
+                    self.ap_mappings[node_id] = current
+
+                if previous is None and current:
+                    changes["new_aps"].append(node_id)
+                elif previous and not current:
+                    changes["removed_aps"].append(node_id)
+                elif previous and current and attachment(previous) != attachment(current):
+                    changes["moved_aps"].append(node_id)
 
-    # Filtering for demo purposes
+            self.last_changes = changes
+            mapping_list = [row for rows in self.ap_mappings.values() for row in rows]
+            return mapping_list, changes
+
+CC_MAPPER = IncrementalMapper()
+
+class CollectionContext:
+    """
+    Holds the Catalyst Center data of a single collection cycle. The physical
+    topology, the AP to switch mapping and the PoE details of every switch are
+    fetched once and shared by every step of the cycle. The request counter
+    shows how many times each Catalyst Center endpoint was called.
+    With max_workers above one, the PoE details of the switches are fetched
+    in parallel, limited to requests_per_second.
+    """
+    def __init__(self, session_c: DNACenterAPI, max_workers: int = 1,
+                 requests_per_second: float = None):
+        self.session = session_c
+        self.max_workers = max_workers
+        self.rate_limiter = (TokenBucket(requests_per_second)
+                             if requests_per_second else None)
+        self.request_counter = Counter()
+        self._lock = threading.Lock()
+        self._topology = None
+        self._mapping = None
+        self._poe_details = {}
+        self._poe_table = None
+
+    @property
+    def topology(self) -> tuple:
+        """
+        Physical topology nodes and links, from the inventory cache on first use.
+        """
+        if self._topology is None:
+            self._topology = INVENTORY_CACHE.get(
+                "topology", CC_HOST, self._fetch_topology
+            )
+        return self._topology
+
+    def _fetch_topology(self) -> tuple:
+        self.request_counter["topology/physical-topology"] += 1
+        return fetch_physical_topology(self.session)
+
+    @property
+    def mapping(self) -> list:
+        """
+        AP to switch port mapping, from the inventory cache on first use.
+        """
+        if self._mapping is None:
+            self._mapping = INVENTORY_CACHE.get(
+                "cc_mapping", CC_HOST, lambda: create_cc_data_mapping(self.session, self)
+            )
+        return self._mapping
+
+    @property
+    def switch_uuids(self) -> list:
+        """
+        Unique switches that have APs connected to them.
+        """
+        return unique_poe_access_sw(self.session, self)
+
+    @property
+    def poe_table(self) -> dict:
+        """
+        (switch UUID, interface name) -> power drawn lookup, built on first use.
+        """
+        if self._poe_table is None:
+            self._poe_table = get_cc_poe_table(self)
+        return self._poe_table
+
+    def poe_interface_details(self, device_uuid: str) -> dict:
+        """
+        PoE interface details of a switch, fetched once per cycle.
+        """
+        if device_uuid not in self._poe_details:
+            with self._lock:
+                self.request_counter[f"network-device/{device_uuid}/interface/poe-detail"] += 1
+            self._poe_details[device_uuid] = call_with_backoff(
+                self.session.devices.poe_interface_details,
+                device_uuid,
+                rate_limiter=self.rate_limiter,
+            )
+        return self._poe_details[device_uuid]
+
+def create_cc_data_mapping(session_c: DNACenterAPI, context: CollectionContext = None,
+                           incremental: bool = CC_INCREMENTAL_MAPPING,
+                           topology_data: tuple = None) -> list:
+    """
+    This function returns a list of dictionaries with interfaceUuid, AP_Uuid and SW_Uuid data.
+    The data is retrieved by the Topology API of Cisco Catalyt Center.
+    It will return a list of dictionaries if successful, otherwise it returns an empty list.
+    When a collection context is given, its already fetched topology is used,
+    and already fetched topology nodes and links can be given as topology_data.
+    In incremental mode only the APs affected by topology changes since the
+    previous call are remapped.
+    """
+    if topology_data is None and context is not None:
+        topology_data = context.topology
+    elif topology_data is None:
+        topology_data = get_physical_topology_nodes_links(session_c)
+    nodes, links = topology_data
+
+    if incremental:
+        mapping_list, changes = CC_MAPPER.update(nodes, links)
+        logging.info("Topology changes: %s new, %s moved, %s removed APs",
+                     len(changes["new_aps"]), len(changes["moved_aps"]),
+                     len(changes["removed_aps"]))
+        return filter_demo_aps(mapping_list)
+
+    return cc_mapping_from_topology(nodes, links)
+
+def cc_mapping_from_topology(nodes: list, links: list) -> list:
+    """
+    Builds the AP to switch port mapping from already retrieved topology nodes and links.
+    """
+    mapping_list = map_aps_to_switches(build_topology_index(nodes, links))
+    return filter_demo_aps(mapping_list)
+
+def filter_demo_aps(mapping_list: list) -> list:
+    """
+    Filtering for demo purposes
+    """
     demo_mapping_list = [ap for ap in mapping_list if "Skog" in ap["interface_label"]]
     return demo_mapping_list
 
-def unique_poe_access_sw(session_c: DNACenterAPI) -> list:
+def unique_poe_access_sw(session_c: DNACenterAPI, context: CollectionContext = None) -> list:
     """
     Retrieves list of all switches that have APs connected to them
     """
-    poe_devices_data = create_cc_data_mapping(session_c)
+    if context is not None:
+        poe_devices_data = context.mapping
+    else:
+        poe_devices_data = create_cc_data_mapping(session_c)
     all_switches = []
     for item in poe_devices_data:
         all_switches.append(item["switch_deviceUuid"])
@@ -138,37 +531,75 @@ def unique_poe_access_sw(session_c: DNACenterAPI) -> list:
 
     return uniqe_switches_uuids
 
-def get_cc_poe_data(session_c: DNACenterAPI, interface_name: str) -> int:
+def get_switch_poe_details(context: CollectionContext, device_uuid: str) -> dict:
     """
-    Retrieves PoE consumption data per switch interface that is connected
-    to an Access Point.
+    Retrieves the PoE interface details of a single switch, or None on failure.
     """
-    unique_switch_ids = unique_poe_access_sw(session_c)
-    for item in unique_switch_ids:
-        device_uuid = item
-        try:
-            response = session_c.devices.poe_interface_details(device_uuid)
-            for poe_interface in response["response"]:
-                if poe_interface["interfaceName"] == interface_name:
-                    poe_data_watts = poe_interface["portPowerDrawn"]
-            return poe_data_watts
-        except (requests.exceptions.RequestException, ValueError) as e:
-            logging.error("Failed to get PoE interface details from CC: %s", e)
-            return None
+    try:
+        return context.poe_interface_details(device_uuid)
+    except (requests.exceptions.RequestException, ValueError, ApiError) as e:
+        logging.error("Failed to get PoE interface details from CC: %s", e)
+        return None
+
+def get_cc_poe_table(context: CollectionContext) -> dict:
+    """
+    Retrieves the PoE interface details of every switch that has APs connected
+    to it, with one API call per switch. Returns a dictionary keyed by
+    (switch UUID, interface name) with the power drawn by the interface.
+    The calls run in parallel when the context allows more than one worker.
+    """
+    switch_uuids = context.switch_uuids
+    if context.max_workers > 1:
+        with ThreadPoolExecutor(max_workers=context.max_workers) as executor:
+            responses = list(executor.map(
+                lambda device_uuid: get_switch_poe_details(context, device_uuid),
+                switch_uuids,
+            ))
+    else:
+        responses = [get_switch_poe_details(context, device_uuid)
+                     for device_uuid in switch_uuids]
+
+    return poe_table_from_responses(switch_uuids, responses)
+
+def poe_table_from_responses(switch_uuids: list, responses: list) -> dict:
+    """
+    Builds the (switch UUID, interface name) -> power drawn lookup from the
+    PoE interface details responses of the switches. Failed responses are None.
+    """
+    poe_table = {}
+    for device_uuid, response in zip(switch_uuids, responses):
+        if response is None:
+            continue
+        for poe_interface in response["response"]:
+            poe_table[(device_uuid, poe_interface["interfaceName"])] = (
+                poe_interface.get("portPowerDrawn")
+            )
+    return poe_table
 
-def build_cc_dataset(session_c) -> list:
+def build_cc_dataset(session_c, context: CollectionContext = None) -> list:
     """
     Builds the final dataset that will be stored in the database with relevant data
-    for Catalyst Center.
+    for Catalyst Center. All steps share one collection context, so the topology
+    and the switch list are fetched only once per cycle, and the PoE details are
+    fetched once per switch and joined to the AP mapping in memory.
     """
-    data_list = []
+    if context is None:
+        context = CollectionContext(session_c)
 
-    data = create_cc_data_mapping(session_c)
+    data_list = cc_rows(context.mapping, context.poe_table)
 
-    for item in data:
+    logging.info("Catalyst Center requests in this cycle: %s", dict(context.request_counter))
+    return data_list
+
+def cc_rows(mapping: list, poe_table: dict) -> list:
+    """
+    Joins the AP to switch port mapping with the PoE lookup into dataset rows.
+    """
+    data_list = []
+    for item in mapping:
 
         interface_name = item["interface_name"]
-        poe_consumption = get_cc_poe_data(session_c, interface_name)
+        poe_consumption = poe_table.get((item["switch_deviceUuid"], interface_name))
 
         dataset = {}
         dataset["sw_name"] = item["switch_label"]
@@ -182,20 +613,146 @@ def build_cc_dataset(session_c) -> list:
         data_list.append(dataset)
     return data_list
 
+def build_cc_dataset_concurrent(session_c,
+                                max_workers: int = CC_MAX_WORKERS,
+                                requests_per_second: float = CC_REQUESTS_PER_SECOND) -> list:
+    """
+    Builds the same dataset as build_cc_dataset, but fetches the PoE details of
+    the switches with a bounded pool of workers and a token bucket rate limit.
+    """
+    context = CollectionContext(session_c,
+                                max_workers=max_workers,
+                                requests_per_second=requests_per_second)
+    return build_cc_dataset(session_c, context)
+
+def task_id_of(response) -> str:
+    """
+    Returns the task id of an asynchronous Catalyst Center API response,
+    or None if the response has no task.
+    """
+    try:
+        return response["response"]["taskId"]
+    except (KeyError, TypeError):
+        return None
+
+def task_result(task: dict) -> tuple:
+    """
+    Returns (done, error) of a Catalyst Center task. A task is done when it
+    has an end time or has failed.
+    """
+    if task.get("isError"):
+        return True, task.get("failureReason") or task.get("progress") or "Task failed"
+    return task.get("endTime") is not None, None
+
+def poll_cc_task(session_c: DNACenterAPI, task_id: str, rate_limiter: TokenBucket) -> dict:
+    """
+    Retrieves a Catalyst Center task. Returns None if the poll failed.
+    """
+    try:
+        return call_with_backoff(
+            session_c.task.get_task_by_id, task_id, rate_limiter=rate_limiter
+        )["response"]
+    except (requests.exceptions.RequestException, KeyError, ApiError) as e:
+        logging.error("Failed to get task %s from CC: %s", task_id, e)
+        return None
+
+def wait_for_cc_tasks(session_c: DNACenterAPI, task_ids: list,
+                      timeout: float = CC_TASK_TIMEOUT,
+                      max_workers: int = CC_MAX_WORKERS,
+                      requests_per_second: float = CC_REQUESTS_PER_SECOND) -> dict:
+    """
+    Waits until every Catalyst Center task is done. All pending tasks are
+    polled together in each round, so the total wait is about the time of the
+    slowest task. The interval between rounds starts short and doubles while
+    no task completes, up to CC_TASK_POLL_INTERVALS. Returns a dictionary of
+    task id -> error, where the error is None for tasks that succeeded.
+    """
+    min_interval, max_interval = CC_TASK_POLL_INTERVALS
+    rate_limiter = TokenBucket(requests_per_second)
+    pending = set(task_ids)
+    results = {}
+    interval = min_interval
+    deadline = time.monotonic() + timeout
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            time.sleep(interval)
+            polled = list(pending)
+            tasks = executor.map(
+                lambda task_id: poll_cc_task(session_c, task_id, rate_limiter), polled
+            )
+            for task_id, task in zip(polled, tasks):
+                if task is None:
+                    continue
+                done, error = task_result(task)
+                if done:
+                    results[task_id] = error
+                    pending.discard(task_id)
+
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                logging.error("%s CC tasks not completed within %s s", len(pending), timeout)
+                for task_id in pending:
+                    results[task_id] = f"Task not completed within {timeout} s"
+                break
+            # Poll again soon while tasks are completing, otherwise back off
+            if len(pending) < len(polled):
+                interval = min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+
+    return results
+
+def get_cc_admin_states(session_c: DNACenterAPI, switch_uuids: list,
+                        max_workers: int = CC_MAX_WORKERS,
+                        requests_per_second: float = CC_REQUESTS_PER_SECOND) -> dict:
+    """
+    Retrieves the admin status of every interface of the switches with one
+    API call per switch. Returns a dictionary of interface UUID -> "UP"/"DOWN".
+    Interfaces of switches that could not be retrieved are missing.
+    """
+    rate_limiter = TokenBucket(requests_per_second)
+
+    def get_interfaces(device_uuid):
+        try:
+            return call_with_backoff(
+                session_c.devices.get_interface_info_by_id, device_uuid,
+                rate_limiter=rate_limiter,
+            )["response"]
+        except (requests.exceptions.RequestException, KeyError, ApiError) as e:
+            logging.error("Failed to get interfaces of %s from CC: %s", device_uuid, e)
+            return []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        responses = executor.map(get_interfaces, switch_uuids)
+        return {
+            interface["id"]: (interface.get("adminStatus") or "").upper()
+            for interfaces in responses for interface in interfaces
+        }
+
 
 # Meraki backend
 def initiate_meraki_session() -> DashboardAPI:
     """
-    Returns an instance of the DashboardAPI class from meraki
+    Returns the shared DashboardAPI client of MERAKI_KEY from the session registry
     """
     try:
-        dashboard = DashboardAPI(MERAKI_KEY, print_console=False)
+        dashboard = get_meraki_session(MERAKI_KEY)
         return dashboard
     except (requests.exceptions.RequestException, ValueError) as e:
         logging.error("Failed to initiate Meraki Dashboard session: %s", e)
         return None
 
 def get_organization_id(session_m: DashboardAPI) -> str:
+    """
+    Retrieves organization ID from the inventory cache
+    """
+    return INVENTORY_CACHE.get(
+        "organization", ORG, lambda: fetch_organization_id(session_m)
+    )
+
+def fetch_organization_id(session_m: DashboardAPI) -> str:
     """
     Retrieves organization ID
     """
@@ -212,18 +769,29 @@ def get_organization_id(session_m: DashboardAPI) -> str:
         logging.error("Failed to get Meraki organization ID data: %s", e)
         return None
 
-def get_network_ids(session_m: DashboardAPI) -> list:
+def get_network_ids(session_m: DashboardAPI, networks: list = None) -> list:
+    """
+    Retrieves network IDs for specific organization from the inventory cache
+    """
+    networks = networks or NETWORKS
+    return INVENTORY_CACHE.get(
+        "networks", (ORG, tuple(networks)), lambda: fetch_network_ids(session_m, networks)
+    )
+
+def fetch_network_ids(session_m: DashboardAPI, networks: list = None) -> list:
     """
-    Retrieves network IDs for specific organization
+    Retrieves network IDs for specific organization. By default the IDs of
+    the networks in NETWORKS, otherwise of the given network names.
     """
+    networks = networks or NETWORKS
     organization_id = get_organization_id(session_m)
     try:
-        networks = session_m.organizations.getOrganizationNetworks(
+        organization_networks = session_m.organizations.getOrganizationNetworks(
             organization_id, total_pages="all"
         )
         network_ids = []
-        for network in networks:
-            if network["name"] in NETWORKS:
+        for network in organization_networks:
+            if network["name"] in networks:
                 network_ids.append(network["id"])
 
         return network_ids
@@ -232,87 +800,357 @@ def get_network_ids(session_m: DashboardAPI) -> list:
         return None
 
 
-def get_access_devices(session_m: DashboardAPI) -> list:
+def get_access_devices(session_m: DashboardAPI, networks: list = None) -> list:
+    """
+    Retrieves all meraki access devices (switches and wireless) of every network
+    in NETWORKS (or the given networks) from the inventory cache.
+    """
+    networks = networks or NETWORKS
+    return INVENTORY_CACHE.get(
+        "devices", (ORG, tuple(networks)), lambda: fetch_access_devices(session_m, networks)
+    )
+
+def fetch_access_devices(session_m: DashboardAPI, networks: list = None) -> list:
     """
-    Retrieves all meraki access devices (switches and wireless)
+    Retrieves all meraki access devices (switches and wireless) of every network
+    in NETWORKS (or the given networks), paging through the organization inventory.
     """
-    network_ids_list = get_network_ids(session_m)
+    organization_id = get_organization_id(session_m)
+    network_ids_list = get_network_ids(session_m, networks)
+    if not network_ids_list:
+        return []
+
+    try:
+        devices_data = session_m.organizations.getOrganizationDevices(
+            organization_id, total_pages="all", networkIds=network_ids_list
+        )
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error("Failed to get Meraki network devices data: %s", e)
+        return None
 
+    return access_devices_from(devices_data)
+
+def access_devices_from(devices_data: list) -> list:
+    """
+    Filters the switches and wireless devices from a list of Meraki devices.
+    """
     access_data = []
+    for device in devices_data:
+        if "switch" in device["firmware"]:
+            access_data.append(device)
+        elif "wireless" in device["firmware"]:
+            access_data.append(device)
+    return access_data
 
-    for item in network_ids_list:
-        networkid = item
+def port_statuses_by_switch(response) -> dict:
+    """
+    Converts the response of the organization-wide switch port statuses endpoint
+    to a dictionary of switch serial -> port statuses.
+    """
+    items = response["items"] if isinstance(response, dict) else response
+    return {item["serial"]: item["ports"] for item in items}
+
+def port_statuses_request(organization_id: str, network_ids: list) -> tuple:
+    """
+    Metadata, URL and query parameters of the first page of the
+    organization-wide switch port statuses endpoint
+    (getOrganizationSwitchPortsStatusesBySwitch). The endpoint is newer than
+    the pinned SDK, so it is called through the REST session of the SDK,
+    which still handles the retries and rate limits.
+    """
+    metadata = {
+        "tags": ["switch", "monitor", "ports", "statuses", "bySwitch"],
+        "operation": "getOrganizationSwitchPortsStatusesBySwitch",
+    }
+    url = f"/organizations/{organization_id}/switch/ports/statuses/bySwitch"
+    params = [("perPage", MERAKI_PORT_STATUSES_PER_PAGE)]
+    params += [("networkIds[]", network_id) for network_id in network_ids]
+    return metadata, url, params
+
+def get_organization_port_statuses(session_m: DashboardAPI, organization_id: str,
+                                   network_ids: list) -> dict:
+    """
+    Retrieves the port statuses of every switch in the networks with the
+    organization-wide endpoint, following the next page links.
+    Returns a dictionary of switch serial -> port statuses.
+    """
+    metadata, url, params = port_statuses_request(organization_id, network_ids)
+    statuses = {}
+    while url:
+        response = session_m._session.request(metadata, "GET", url, params=params)
+        statuses.update(port_statuses_by_switch(response.json()))
+        # The next page link already carries the query parameters
+        url, params = response.links.get("next", {}).get("url"), None
+        response.close()
+    return statuses
+
+def get_active_poe_port_statuses(session_m: DashboardAPI, networks: list = None) -> dict:
+    """
+    Retrieve all PoE port statuses and watt data of every switch in NETWORKS
+    (or the given networks).
+    Returns a dictionary of switch serial -> port statuses. The organization-wide
+    endpoint is used first. If it fails, every switch is requested separately,
+    and switches that fail are left out.
+    """
+    access_data = get_access_devices(session_m, networks)
+    switch_serials = [access_device["serial"] for access_device in access_data
+                      if "switch" in access_device["firmware"]]
+    if not switch_serials:
+        return {}
+
+    organization_id = get_organization_id(session_m)
+    if organization_id is not None:
         try:
-            devices_data = session_m.networks.getNetworkDevices(networkid)
-            for device in devices_data:
-                if "switch" in device["firmware"]:
-                    access_data.append(device)
-                elif "wireless" in device["firmware"]:
-                    access_data.append(device)
+            statuses = get_organization_port_statuses(
+                session_m, organization_id, get_network_ids(session_m, networks)
+            )
+            return {serial: statuses.get(serial, []) for serial in switch_serials}
+        except (requests.exceptions.RequestException, ValueError, KeyError,
+                MerakiAPIError) as e:
+            logging.warning("Organization-wide switch port statuses failed, "
+                            "requesting every switch: %s", e)
 
-            return access_data
-        except (requests.exceptions.RequestException, ValueError) as e:
-            logging.error("Failed to get Meraki network devices data: %s", e)
-            return None
+    port_statuses = {}
+    for serial in switch_serials:
+        try:
+            port_statuses[serial] = session_m.switch.getDeviceSwitchPortsStatuses(
+                serial=serial, timespan=3600
+            )
+        except (requests.exceptions.RequestException, ValueError, MerakiAPIError) as e:
+            logging.error("Failed to get Meraki switchport data of %s: %s", serial, e)
+    return port_statuses
 
 
-def get_active_poe_port_statuses(session_m: DashboardAPI) -> list:
+def build_meraki_dataset(session_m: DashboardAPI, networks: list = None) -> Iterator[dict]:
     """
-    Retrieve all PoE port statuses and watt data.
+    Builds final meraki dataset from all switches in NETWORKS, or in the given
+    networks when the collection is sharded per network. Yields one row per
+    powered access port, so large organizations can be streamed to the writer.
     """
-    access_data = get_access_devices(session_m)
+    access_data = get_access_devices(session_m, networks)
+    port_statuses = get_active_poe_port_statuses(session_m, networks)
+    if not access_data or port_statuses is None:
+        return
 
+    ap_index = build_ap_index(access_data)
     for access_device in access_data:
         if "switch" in access_device["firmware"]:
-            sw_serial = access_device["serial"]
-    try:
-        port_statuses = session_m.switch.getDeviceSwitchPortsStatuses(
-            serial=sw_serial, timespan=3600
-        )
+            yield from meraki_rows(access_device, ap_index,
+                                   port_statuses.get(access_device["serial"], []))
 
-        return port_statuses
-    except (requests.exceptions.RequestException, ValueError) as e:
-        logging.error("Failed to get Meraki switchport data: %s", e)
+def normalise_mac(value: str) -> str:
+    """
+    Returns a MAC address as 12 lowercase hex digits, or None if the value
+    isn't a MAC address.
+    """
+    if not value or not MAC_ADDRESS.match(value):
         return None
-    
+    return re.sub(r"[^0-9a-f]", "", value.lower())
 
+def build_ap_index(access_data: list) -> dict:
+    """
+    Indexes the Meraki wireless devices by MAC address, name and serial, so
+    that neighbours seen on switch ports can be looked up.
+    """
+    ap_index = {}
+    for access_device in access_data:
+        if "wireless" in access_device["firmware"]:
+            for key in (normalise_mac(access_device.get("mac")),
+                        access_device.get("name"),
+                        access_device.get("serial")):
+                if key:
+                    ap_index[key] = access_device
+    return ap_index
 
+def find_attached_ap(port: dict, ap_index: dict) -> dict:
+    """
+    Finds the AP connected to a switch port from the LLDP and CDP neighbour
+    data of the port status. Returns None if no known AP is attached.
+    """
+    lldp = port.get("lldp") or {}
+    cdp = port.get("cdp") or {}
+    system_name = lldp.get("systemName") or ""
+    candidates = (
+        normalise_mac(lldp.get("chassisId")),
+        normalise_mac(cdp.get("deviceId")),
+        system_name,
+        # Meraki APs advertise "<model> - <device name>" as LLDP system name
+        system_name.split(" - ", 1)[-1],
+        cdp.get("deviceId"),
+    )
+    for key in candidates:
+        if key and key in ap_index:
+            return ap_index[key]
+    return None
 
-def build_meraki_dataset(session_m: DashboardAPI) -> dict:
+def meraki_rows(switch_device: dict, ap_index: dict, port_statuses: list) -> Iterator[dict]:
     """
-    Builds final meraki dataset.
+    Yields a Meraki dataset row for every connected, powered, non-uplink port
+    of a switch, with the AP attached to the port.
     """
-    access_data = get_access_devices(session_m)
+    for port in port_statuses:
+        if port["status"] != "Connected" or port["isUplink"]:
+            continue
+        if not port.get("powerUsageInWh"):
+            continue
 
-    for access_device in access_data:
-        if "switch" in access_device["firmware"]:
-            sw_serial = access_device["serial"]
-            sw_model = access_device["model"]
+        access_point = find_attached_ap(port, ap_index) or {}
+        yield {
+            "sw_name": switch_device["model"],
+            "sw_serial": switch_device["serial"],
+            "port_id": port["portId"],
+            "port_name": port["portId"],
+            "power_in_w": port["powerUsageInWh"],
+            "ap_name": access_point.get("model"),
+            "ap_serial": access_point.get("serial"),
+        }
+
+def get_meraki_port_states(session_m: DashboardAPI, serials: list) -> dict:
+    """
+    Retrieves the configured state of the ports of the switches. Returns a
+    dictionary of (serial, port id) -> enabled. Uses the organization-wide
+    endpoint when the SDK has it, otherwise one call per switch.
+    """
+    serials = set(serials)
+    port_states = {}
+    rate_limiter = TokenBucket(MERAKI_REQUESTS_PER_SECOND)
+    try:
+        bulk_ports = getattr(session_m.switch, "getOrganizationSwitchPortsBySwitch", None)
+        organization_id = get_organization_id(session_m)
+        if bulk_ports is not None and organization_id is not None:
+            response = call_with_backoff(bulk_ports, organization_id, total_pages="all",
+                                         rate_limiter=rate_limiter)
+            switches = [(item["serial"], item["ports"]) for item in response
+                        if item["serial"] in serials]
         else:
-            ap_serial = access_device["serial"]
-            ap_model = access_device["model"]
+            switches = [(serial, call_with_backoff(session_m.switch.getDeviceSwitchPorts,
+                                                   serial, rate_limiter=rate_limiter))
+                        for serial in serials]
+    except (requests.exceptions.RequestException, ValueError, KeyError, MerakiAPIError) as e:
+        logging.error("Failed to get Meraki switch ports: %s", e)
+        return port_states
 
-    port_statuses = get_active_poe_port_statuses(session_m)
+    for serial, ports in switches:
+        for port in ports:
+            port_states[(serial, str(port["portId"]))] = port["enabled"]
+    return port_states
 
-    dataset = {}
-    for port in port_statuses:
-        if port["status"] == "Connected":
-            if port["isUplink"] is False:
-                print("not an uplink")
-                if port["powerUsageInWh"] != 0.0:
-                    dataset["sw_name"] = sw_model
-                    dataset["sw_serial"] = sw_serial
-                    dataset["port_id"] = port["portId"]
-                    dataset["port_name"] = port["portId"]
-                    dataset["power_in_w"] = port["powerUsageInWh"]
-                    dataset["ap_name"] = ap_model
-                    dataset["ap_serial"] = ap_serial
-                else:
-                    pass
+def port_update_action(serial: str, port_id, enabled: bool) -> dict:
+    """
+    Action batch action that enables or disables a switch port.
+    """
+    return {
+        "resource": f"/devices/{serial}/switch/ports/{port_id}",
+        "operation": "update",
+        "body": {"enabled": enabled},
+    }
+
+def batch_result(batch: dict) -> tuple:
+    """
+    Returns (done, error) of a Meraki action batch.
+    """
+    status = batch.get("status") or {}
+    if status.get("failed"):
+        return True, "; ".join(status.get("errors") or []) or "Action batch failed"
+    return bool(status.get("completed")), None
+
+def submit_action_batch(session_m: DashboardAPI, organization_id: str, actions: list,
+                        synchronous: bool, rate_limiter: TokenBucket) -> dict:
+    """
+    Creates a confirmed action batch. A batch that could not be created is
+    returned with a failed status.
+    """
+    try:
+        return call_with_backoff(
+            session_m.organizations.createOrganizationActionBatch,
+            organization_id,
+            actions,
+            confirmed=True,
+            synchronous=synchronous,
+            rate_limiter=rate_limiter,
+        )
+    except (requests.exceptions.RequestException, ValueError, MerakiAPIError) as e:
+        logging.error("Failed to create Meraki action batch: %s", e)
+        return {"status": {"failed": True, "errors": [str(e)]}}
+
+def poll_action_batch(session_m: DashboardAPI, organization_id: str, batch_id: str,
+                      rate_limiter: TokenBucket) -> dict:
+    """
+    Retrieves a Meraki action batch. Returns None if the poll failed.
+    """
+    try:
+        return call_with_backoff(
+            session_m.organizations.getOrganizationActionBatch,
+            organization_id,
+            batch_id,
+            rate_limiter=rate_limiter,
+        )
+    except (requests.exceptions.RequestException, ValueError, MerakiAPIError) as e:
+        logging.error("Failed to get Meraki action batch %s: %s", batch_id, e)
+        return None
+
+def run_action_batches(session_m: DashboardAPI, actions: list, synchronous: bool = False,
+                       timeout: float = MERAKI_BATCH_TIMEOUT,
+                       requests_per_second: float = MERAKI_REQUESTS_PER_SECOND) -> list:
+    """
+    Runs actions in as few Meraki action batches as possible. Synchronous
+    batches hold up to 20 actions and are done when created. Asynchronous
+    batches hold up to 100 actions; at most MERAKI_MAX_PENDING_BATCHES run at
+    a time, and they are polled together with the same adaptive interval as
+    the Catalyst Center tasks. Returns one error per action, None on success.
+    Batches are atomic, so all actions of a failed batch get its error.
+    """
+    organization_id = get_organization_id(session_m)
+    if organization_id is None:
+        return ["Meraki organization not found"] * len(actions)
+
+    batch_size = MERAKI_BATCH_SIZES[synchronous]
+    chunks = [(start, actions[start:start + batch_size])
+              for start in range(0, len(actions), batch_size)]
+    rate_limiter = TokenBucket(requests_per_second)
+    min_interval, max_interval = CC_TASK_POLL_INTERVALS
+    interval = min_interval
+    deadline = time.monotonic() + timeout
+    errors = [None] * len(actions)
+    pending = {} # batch id -> (start, chunk)
+
+    def finish(start, chunk, error):
+        errors[start:start + len(chunk)] = [error] * len(chunk)
+
+    while chunks or pending:
+        while chunks and len(pending) < MERAKI_MAX_PENDING_BATCHES:
+            start, chunk = chunks.pop(0)
+            batch = submit_action_batch(session_m, organization_id, chunk,
+                                        synchronous, rate_limiter)
+            done, error = batch_result(batch)
+            if done or synchronous:
+                finish(start, chunk, error if done else "Action batch not completed")
             else:
-                pass
-        else:
-            pass
+                pending[batch["id"]] = (start, chunk)
+        if not pending:
+            continue
+
+        if time.monotonic() >= deadline:
+            logging.error("%s Meraki action batches not completed within %s s",
+                          len(pending), timeout)
+            for start, chunk in pending.values():
+                finish(start, chunk, f"Action batch not completed within {timeout} s")
+            for start, chunk in chunks:
+                finish(start, chunk, "Action batch not submitted")
+            break
 
+        time.sleep(interval)
+        completed = 0
+        for batch_id, (start, chunk) in list(pending.items()):
+            batch = poll_action_batch(session_m, organization_id, batch_id, rate_limiter)
+            if batch is None:
+                continue
+            done, error = batch_result(batch)
+            if done:
+                finish(start, chunk, error)
+                del pending[batch_id]
+                completed += 1
+        # Poll again soon while batches are completing, otherwise back off
+        interval = min_interval if completed else min(interval * 2, max_interval)
 
-    return [dataset]
\ No newline at end of file
+    return errors
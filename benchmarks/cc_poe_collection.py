@@ -0,0 +1,162 @@
+"""
+Benchmark of the Catalyst Center PoE collection.
+
+Starts a local mock Catalyst Center (http.server) with the token, physical
+topology and PoE detail endpoints, and runs build_cc_dataset (one PoE
+request at a time) and build_cc_dataset_concurrent (a pool of workers with
+a token bucket rate limit) through a DNACenterAPI client against it. Every
+PoE request of the mock server takes --latency seconds, and a share of the
+requests is answered with HTTP 429 and a Retry-After header, which
+call_with_backoff retries. Both collections must return identical rows.
+
+    python benchmarks/cc_poe_collection.py
+    python benchmarks/cc_poe_collection.py --switches 200 --latency 0.02 --workers 16 --rate 500
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dnacentersdk import DNACenterAPI
+
+import backend
+from sessions import size_connection_pool
+from topology_mapping import synthetic_topology
+
+RETRY_AFTER = 1 # Seconds, the shortest wait the SDK accepts from a Retry-After header
+POE_DETAIL_PATH = re.compile(r"^/dna/intent/api/v1/network-device/([^/]+)/interface/poe-detail$")
+
+
+class MockCatalystCenter(ThreadingHTTPServer):
+    """
+    Local Catalyst Center with the token, topology and PoE detail endpoints.
+    """
+    daemon_threads = True
+
+    def __init__(self, nodes: list, links: list, latency: float, rate_limited: float, seed: int = 1):
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.topology = {"response": {"nodes": nodes, "links": links}}
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.throttled = 0
+            self._random.seed(1)
+
+    def throttle(self) -> bool:
+        """
+        Counts a PoE request and returns True if it is rate limited.
+        """
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self.rate_limited:
+                self.throttled += 1
+                return True
+        return False
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/dna/system/api/v1/auth/token":
+            self.send_json(200, {"Token": "mock-token"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        match = POE_DETAIL_PATH.match(path)
+        if path == "/dna/intent/api/v1/topology/physical-topology":
+            self.send_json(200, self.server.topology)
+        elif match:
+            time.sleep(self.server.latency)
+            if self.server.throttle():
+                self.send_json(429, {"error": "Too Many Requests"},
+                               {"Retry-After": str(RETRY_AFTER)})
+                return
+            device_uuid = match.group(1)
+            self.send_json(200, {"response": [
+                {"interfaceName": f"GigabitEthernet1/0/{port}",
+                 "portPowerDrawn": str((sum(map(ord, device_uuid)) * port % 300) / 10)}
+                for port in range(1, 49)
+            ]})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--switches", type=int, default=200, help="Switches with APs")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per PoE request")
+    parser.add_argument("--rate-limited", type=float, default=0.02,
+                        help="Share of the PoE requests answered with HTTP 429")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=500, help="Requests per second")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR) # The retries are counted instead of logged
+
+    nodes, links = synthetic_topology(args.switches * 20)
+    server = MockCatalystCenter(nodes, links, args.latency, args.rate_limited)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # The SDK would sleep on 429 itself, call_with_backoff does the retries here
+    session = DNACenterAPI(base_url=server.base_url, username="admin", password="admin",
+                           verify=False, wait_on_rate_limit=False)
+    size_connection_pool(session, args.workers)
+
+    results = {}
+    for name, collect in (
+        ("sequential", backend.build_cc_dataset),
+        (f"{args.workers} workers",
+         lambda session: backend.build_cc_dataset_concurrent(session, args.workers, args.rate)),
+    ):
+        server.reset()
+        start = time.perf_counter()
+        rows = collect(session)
+        duration = time.perf_counter() - start
+        results[name] = rows
+        print(f"{name:>12}: {duration:.2f} s, {len(rows)} rows, "
+              f"{server.requests} PoE requests ({server.throttled} rate limited)")
+    server.shutdown()
+
+    sequential, concurrent = results.values()
+    if sequential != concurrent:
+        sys.exit("The concurrent collection returned different rows")
+    print("Rows are identical")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark of the port database lookups of Way2.py.
+
+Writes a port database CSV with --ports ports (half Catalyst Center, half
+Meraki switches with 48 ports each) and runs "Way2.py down" against fake
+sessions that answer instantly, so the run time is the time spent reading
+and looking up the port database. Counts the read_csv calls of the run and
+times the original lookup, which read the whole CSV for every port, on a
+sample of the ports.
+
+    python benchmarks/port_database.py
+    python benchmarks/port_database.py --ports 10000 --legacy-sample 50
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "way2")))
+
+import pandas as pd
+
+import Way2
+
+
+class FakeSession:
+    """
+    Fake Catalyst Center and Meraki session that counts the port updates.
+    """
+    def __init__(self):
+        self.updates = 0
+        self.devices = self
+        self.switch = self
+
+    def update_interface_details(self, interface_uuid, payload):
+        self.updates += 1
+        return {}
+
+    def updateDeviceSwitchPort(self, serial, port_id, enabled):
+        self.updates += 1
+
+
+def write_port_database(path: str, port_count: int) -> None:
+    """
+    Writes a port database with port_count ports to a CSV file.
+    """
+    rows = []
+    for index in range(port_count):
+        switch, port = divmod(index, 48)
+        if index % 2:
+            rows.append(("meraki", "MS120-48LP", f"Q2XX-{switch:04d}", str(port + 1),
+                         str(port + 1), "MR36", f"Q3AP-{index:05d}"))
+        else:
+            rows.append(("cc", f"C9300-{switch}", f"switch-uuid-{switch}", f"interface-uuid-{index}",
+                         f"GigabitEthernet1/0/{port + 1}", f"AP-{index}", "C9130AXI"))
+    pd.DataFrame(rows, columns=Way2.PORT_COLUMNS).to_csv(path, index=False)
+
+def legacy_find_interface_name(file_path: str, port_id: str) -> str:
+    """
+    The original lookup: reads the whole port database for every port.
+    """
+    data = pd.read_csv(file_path)
+    matches = data[data["port"] == port_id]["port_name"].values
+    return matches[0] if len(matches) else ""
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ports", type=int, default=10000)
+    parser.add_argument("--legacy-sample", type=int, default=50,
+                        help="Ports the original lookup is timed on")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "port_database.csv")
+    write_port_database(path, args.ports)
+    Way2.PORT_DATABASE = path
+
+    session = FakeSession()
+    Way2.initiate_meraki_session = Way2.initiate_cc_session = lambda: session
+    read_csv_calls = 0
+    read_csv = pd.read_csv
+
+    def counted_read_csv(*read_args, **read_kwargs):
+        nonlocal read_csv_calls
+        read_csv_calls += 1
+        return read_csv(*read_args, **read_kwargs)
+
+    Way2.pd.read_csv = counted_read_csv
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Way2.main(["down"])
+    duration = time.perf_counter() - start
+    Way2.pd.read_csv = read_csv
+    print(f"Way2 down: {args.ports} ports, {session.updates} updates, "
+          f"{read_csv_calls} read_csv calls, {duration:.2f} s")
+
+    sample = pd.read_csv(path, dtype=str)["port"].head(args.legacy_sample)
+    start = time.perf_counter()
+    for port_id in sample:
+        legacy_find_interface_name(path, port_id)
+    per_port = (time.perf_counter() - start) / len(sample)
+    print(f"Original lookup: {per_port * 1000:.1f} ms per port, "
+          f"about {per_port * args.ports:.0f} s for {args.ports} ports")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark of the AP to switch mapping of Catalyst Center.
+
+Generates synthetic physical topologies (5 % switches, every AP linked to
+one switch) and times the indexed mapping of backend.py against the
+original mapping, which scanned all links and nodes for every AP. Both
+mappings must return the same rows.
+
+    python benchmarks/topology_mapping.py
+    python benchmarks/topology_mapping.py --sizes 1000 10000 100000 --legacy-limit 10000
+
+The original mapping is quadratic, so it is only timed up to --legacy-limit nodes.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from operator import itemgetter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from backend import build_topology_index, map_aps_to_switches
+
+
+def synthetic_topology(node_count: int, switch_ratio: float = 0.05, seed: int = 1) -> tuple:
+    """
+    Returns the nodes and links of a topology with node_count nodes. Every AP
+    has one link to a random switch, in random direction.
+    """
+    rng = random.Random(seed)
+    switch_count = max(1, int(node_count * switch_ratio))
+    nodes = [
+        {"id": f"sw-{index}", "label": f"switch-{index}", "family": "Switches and Hubs",
+         "platformId": "C9300-48P"}
+        for index in range(switch_count)
+    ]
+    links = []
+    for index in range(node_count - switch_count):
+        ap_id = f"ap-{index}"
+        nodes.append({"id": ap_id, "label": f"Skog-AP-{index}", "family": "Unified AP",
+                      "platformId": "C9130AXI"})
+        switch_id = f"sw-{rng.randrange(switch_count)}"
+        port = f"GigabitEthernet1/0/{index % 48 + 1}"
+        if rng.random() < 0.5:
+            links.append({"source": ap_id, "target": switch_id,
+                          "startPortID": f"{ap_id}-port", "startPortName": "GigabitEthernet0",
+                          "endPortID": f"{switch_id}-{port}", "endPortName": port})
+        else:
+            links.append({"source": switch_id, "target": ap_id,
+                          "startPortID": f"{switch_id}-{port}", "startPortName": port,
+                          "endPortID": f"{ap_id}-port", "endPortName": "GigabitEthernet0"})
+    rng.shuffle(nodes)
+    return nodes, links
+
+def legacy_mapping(nodes: list, links: list) -> list:
+    """
+    The original mapping: every AP scans all links, and every link scans all
+    nodes for the switch label.
+    """
+    def get_switch_info(switch_device_uuid):
+        for item in nodes:
+            if item["id"] == switch_device_uuid:
+                return item["label"]
+        return None
+
+    mapping_list = []
+    for node in nodes:
+        if "Unified AP" not in node["family"]:
+            continue
+        ap_device_uuid = node["id"]
+        for link in links:
+            if ap_device_uuid not in (link["source"], link["target"]):
+                continue
+            outgoing = link["source"] == ap_device_uuid
+            switch_device_uuid = link["target"] if outgoing else link["source"]
+            switch_label = get_switch_info(switch_device_uuid)
+            if switch_label:
+                mapping_list.append({
+                    "interface_label": node["label"],
+                    "ap_platform_id": node["platformId"],
+                    "interfaceUuid": link.get("endPortID") if outgoing else link.get("startPortID"),
+                    "interface_name": link.get("endPortName") if outgoing else link.get("startPortName"),
+                    "switch_label": switch_label,
+                    "switch_deviceUuid": switch_device_uuid,
+                    "AP_Uuid": ap_device_uuid,
+                })
+    return mapping_list
+
+def timed(function, *args) -> tuple:
+    """
+    Returns the result of function(*args) and its duration in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Number of topology nodes")
+    parser.add_argument("--legacy-limit", type=int, default=10000,
+                        help="Largest topology the original mapping is timed on")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>8} {'links':>8} {'indexed':>10} {'original':>10}")
+    for size in args.sizes:
+        nodes, links = synthetic_topology(size)
+        indexed, indexed_time = timed(
+            lambda: map_aps_to_switches(build_topology_index(nodes, links))
+        )
+        original_time = "skipped"
+        if size <= args.legacy_limit:
+            original, seconds = timed(legacy_mapping, nodes, links)
+            by_ap = itemgetter("AP_Uuid")
+            if sorted(original, key=by_ap) != sorted(indexed, key=by_ap):
+                sys.exit(f"Mappings differ for {size} nodes")
+            original_time = f"{seconds:.3f} s"
+        print(f"{size:>8} {len(links):>8} {indexed_time:>8.3f} s {original_time:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Long running collector daemon used by way1.py.
+Jobs are scheduled on wall-clock boundaries (e.g. every full minute), so the
+cycles don't drift however long they take. Every job runs in its own worker
+thread, off the scheduler thread. A cycle that is due while the previous one
+is still running is skipped, or coalesced into one cycle that starts as soon
+as the running one finishes. A random jitter can be added to the start of
+every cycle, so jobs with the same interval don't hit the APIs at once. On
+SIGTERM or SIGINT the daemon stops scheduling, waits for the running cycles
+to finish their writes and runs the shutdown callbacks. The duration and the
+lag (start time - scheduled time) of every cycle are logged.
+"""
+import os
+import math
+import time
+import random
+import signal
+import logging
+import threading
+
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "120")) # Seconds to wait for running cycles
+OVERLAP_POLICIES = ("skip", "coalesce")
+
+
+def next_boundary(interval: float, now: float, offset: float = 0.0) -> float:
+    """
+    First wall-clock time after now that is a multiple of the interval
+    (since the epoch, in UTC) plus the offset.
+    """
+    return (math.floor((now - offset) / interval) + 1) * interval + offset
+
+
+class CycleStats:
+    """
+    Duration and lag statistics of the cycles of a job.
+    """
+    def __init__(self):
+        self.cycles = 0
+        self.failed = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def record(self, scheduled: float, started: float, finished: float) -> None:
+        """
+        Records a finished cycle.
+        """
+        self.cycles += 1
+        self.last_duration = finished - started
+        self.max_duration = max(self.max_duration, self.last_duration)
+        self.total_duration += self.last_duration
+        self.last_lag = started - scheduled
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+    def summary(self) -> dict:
+        """
+        Returns the statistics rounded to milliseconds.
+        """
+        return {
+            "cycles": self.cycles,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+            "last_duration": round(self.last_duration, 3),
+            "avg_duration": round(self.total_duration / self.cycles, 3) if self.cycles else 0.0,
+            "max_duration": round(self.max_duration, 3),
+            "last_lag": round(self.last_lag, 3),
+            "max_lag": round(self.max_lag, 3),
+        }
+
+
+class Job:
+    """
+    A function that is called every interval seconds in a worker thread.
+    """
+    def __init__(self, name: str, interval: float, function, args: tuple = (),
+                 overlap: str = "skip", offset: float = 0.0, run_immediately: bool = False,
+                 jitter: float = 0.0, stop_event: threading.Event = None):
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError(f"Unknown overlap policy {overlap}, use one of {OVERLAP_POLICIES}")
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.overlap = overlap
+        self.offset = offset
+        self.jitter = min(jitter, interval / 2)
+        self.stats = CycleStats()
+        self.stop_event = stop_event or threading.Event()
+        now = time.time()
+        self.boundary = now if run_immediately else next_boundary(interval, now, offset)
+        self.next_run = self.boundary if run_immediately else self.boundary + self.random_jitter()
+        self._running = False
+        self._pending = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def random_jitter(self) -> float:
+        """
+        Random delay of a cycle after its boundary.
+        """
+        return random.uniform(0, self.jitter) if self.jitter else 0.0
+
+    def advance(self, now: float) -> None:
+        """
+        Moves the next run to the first boundary after now, plus the jitter.
+        Boundaries that passed while the scheduler was not running (e.g. suspend)
+        are counted as skipped.
+        """
+        following = next_boundary(self.interval, now, self.offset)
+        missed = math.ceil(round((following - self.boundary) / self.interval, 6)) - 1
+        if missed > 0:
+            self.stats.skipped += missed
+        self.boundary = following
+        self.next_run = following + self.random_jitter()
+
+    def trigger(self, scheduled: float) -> None:
+        """
+        Starts the cycle scheduled at the given time in a worker thread, unless
+        the previous cycle is still running.
+        """
+        with self._lock:
+            if self._running:
+                if self.overlap == "coalesce":
+                    # All cycles missed while running become one cycle
+                    self.stats.coalesced += self._pending is not None
+                    self._pending = scheduled
+                else:
+                    self.stats.skipped += 1
+                logging.warning("Previous %s cycle still running, %s the cycle",
+                                self.name, "coalescing" if self.overlap == "coalesce" else "skipping")
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._work, args=(scheduled,), name=f"collector-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def _work(self, scheduled: float) -> None:
+        """
+        Runs the cycle, followed by the coalesced cycle if one is pending.
+        A pending cycle is dropped once the daemon is stopping.
+        """
+        while scheduled is not None:
+            self._run_cycle(scheduled)
+            with self._lock:
+                scheduled, self._pending = self._pending, None
+                if scheduled is not None and self.stop_event.is_set():
+                    logging.info("Daemon stopping, dropping the coalesced %s cycle", self.name)
+                    self.stats.skipped += 1
+                    scheduled = None
+                if scheduled is None:
+                    self._running = False
+
+    def _run_cycle(self, scheduled: float) -> None:
+        """
+        Runs one cycle and records its statistics.
+        """
+        started = time.time()
+        try:
+            self.function(*self.args)
+        except Exception: # A failed cycle must not stop the daemon
+            logging.exception("The %s cycle failed", self.name)
+            self.stats.failed += 1
+        self.stats.record(scheduled, started, time.time())
+        logging.info("%s cycle stats: %s", self.name, self.stats.summary())
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Waits for the running cycle. Returns False if it is still running.
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+
+class CollectorDaemon:
+    """
+    Scheduler of the collection jobs. run() blocks until stop() is called,
+    e.g. from the SIGTERM handler.
+    """
+    def __init__(self, shutdown_timeout: float = SHUTDOWN_TIMEOUT):
+        self.shutdown_timeout = shutdown_timeout
+        self.jobs = []
+        self._shutdown_callbacks = []
+        self._stop = threading.Event()
+
+    def add_job(self, name: str, interval: float, function, *args, overlap: str = "skip",
+                offset: float = 0.0, run_immediately: bool = False, jitter: float = 0.0) -> Job:
+        """
+        Schedules function(*args) every interval seconds, on the wall-clock
+        boundaries of the interval shifted by offset, plus up to jitter seconds
+        (at most half the interval).
+        """
+        job = Job(name, interval, function, args, overlap, offset, run_immediately, jitter,
+                  self._stop)
+        self.jobs.append(job)
+        return job
+
+    def on_shutdown(self, callback) -> None:
+        """
+        Registers a function that is called after the last cycles finished.
+        """
+        self._shutdown_callbacks.append(callback)
+
+    def install_signal_handlers(self) -> None:
+        """
+        Stops the daemon gracefully on SIGTERM and SIGINT.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def stop(self, *_) -> None:
+        """
+        Asks the scheduler to stop. Can be used as signal handler.
+        """
+        self._stop.set()
+
+    def run(self) -> None:
+        """
+        Triggers the jobs on their boundaries until stop() is called, then
+        shuts down gracefully.
+        """
+        logging.info("Collector daemon started with jobs %s",
+                     [(job.name, job.interval) for job in self.jobs])
+        while not self._stop.is_set():
+            now = time.time()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    job.trigger(job.next_run)
+                    job.advance(now)
+            wake_up = min(job.next_run for job in self.jobs)
+            self._stop.wait(max(0.0, wake_up - time.time()))
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        """
+        Waits for the running cycles so that their writes are flushed, then
+        runs the shutdown callbacks.
+        """
+        logging.info("Collector daemon stopping, waiting for running cycles")
+        deadline = time.monotonic() + self.shutdown_timeout
+        for job in self.jobs:
+            if not job.join(max(0.0, deadline - time.monotonic())):
+                logging.error("The %s cycle did not finish within %s s",
+                              job.name, self.shutdown_timeout)
+        for callback in self._shutdown_callbacks:
+            callback()
+        for job in self.jobs:
+            logging.info("%s final stats: %s", job.name, job.stats.summary())
+        logging.info("Collector daemon stopped")
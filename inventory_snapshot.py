@@ -0,0 +1,162 @@
+"""
+Persistent on-disk snapshot of the inventory cache in backend.py.
+The organization, networks, devices, topology and AP to switch mapping are
+stored in a local SQLite file, so that way1.py and Way2.py can start from the
+snapshot in milliseconds and refresh the inventory in the background.
+Every entry is stored with an ETag (hash of its content), so unchanged entries
+are never rewritten.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import hashlib
+import threading
+
+import backend
+
+SNAPSHOT_PATH = os.getenv("INVENTORY_SNAPSHOT", "inventory_snapshot.db")
+SNAPSHOT_VERSION = 1 # Increase when the format of the cached data changes
+SNAPSHOT_MAX_AGE = 7 * 24 * 3600 # Older entries are not loaded at startup
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Opens the snapshot database and creates its tables if needed.
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (version INTEGER NOT NULL)")
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS inventory (
+            data_class TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            etag TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (data_class, key)
+        )"""
+    )
+    return connection
+
+def as_tuple(value):
+    """
+    JSON turns tuples into lists. Converts cache keys back to tuples.
+    """
+    if isinstance(value, list):
+        return tuple(as_tuple(item) for item in value)
+    return value
+
+def etag(value_json: str) -> str:
+    """
+    Content hash of a serialized cache entry.
+    """
+    return hashlib.sha1(value_json.encode()).hexdigest()
+
+def save_snapshot(path: str = SNAPSHOT_PATH) -> list:
+    """
+    Stores the inventory cache to the snapshot file. Only entries whose ETag
+    changed are rewritten. Returns the (data class, key) of changed entries.
+    """
+    now = time.time()
+    changed = []
+    with connect(path) as connection:
+        connection.execute("DELETE FROM meta")
+        connection.execute("INSERT INTO meta (version) VALUES (?)", (SNAPSHOT_VERSION,))
+        stored = {
+            (data_class, key): stored_etag
+            for data_class, key, stored_etag
+            in connection.execute("SELECT data_class, key, etag FROM inventory")
+        }
+        for data_class, key, value in backend.INVENTORY_CACHE.items():
+            key_json = json.dumps(key)
+            value_json = json.dumps(value)
+            value_etag = etag(value_json)
+            if stored.get((data_class, key_json)) == value_etag:
+                connection.execute(
+                    "UPDATE inventory SET fetched_at = ? WHERE data_class = ? AND key = ?",
+                    (now, data_class, key_json),
+                )
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO inventory VALUES (?, ?, ?, ?, ?)",
+                    (data_class, key_json, value_json, value_etag, now),
+                )
+                changed.append((data_class, key))
+    connection.close()
+    return changed
+
+def load_snapshot(path: str = SNAPSHOT_PATH) -> int:
+    """
+    Loads the snapshot file into the inventory cache. Snapshots of another
+    version and entries older than SNAPSHOT_MAX_AGE are ignored.
+    Returns the number of loaded entries.
+    """
+    if not os.path.exists(path):
+        return 0
+    connection = connect(path)
+    try:
+        version = connection.execute("SELECT version FROM meta").fetchone()
+        if version is None or version[0] != SNAPSHOT_VERSION:
+            logging.info("Ignoring inventory snapshot of another version")
+            return 0
+        rows = connection.execute(
+            "SELECT data_class, key, value, fetched_at FROM inventory"
+        ).fetchall()
+    finally:
+        connection.close()
+
+    loaded = 0
+    for data_class, key_json, value_json, fetched_at in rows:
+        if time.time() - fetched_at > SNAPSHOT_MAX_AGE:
+            continue
+        backend.INVENTORY_CACHE.put(data_class, as_tuple(json.loads(key_json)),
+                                    json.loads(value_json))
+        loaded += 1
+    logging.info("Loaded %s inventory entries from %s", loaded, path)
+    return loaded
+
+def refresh_inventory(session_m, session_c) -> None:
+    """
+    Fetches the inventory from the APIs and replaces the cached entries,
+    without invalidating the cache first, so readers are never blocked.
+    """
+    cache = backend.INVENTORY_CACHE
+    inventory_key = (backend.ORG, tuple(backend.NETWORKS))
+
+    if session_m is not None:
+        for data_class, key, fetch in (
+            ("organization", backend.ORG, backend.fetch_organization_id),
+            ("networks", inventory_key, backend.fetch_network_ids),
+            ("devices", inventory_key, backend.fetch_access_devices),
+        ):
+            value = fetch(session_m)
+            if value is not None:
+                cache.put(data_class, key, value)
+
+    if session_c is not None:
+        topology_data = backend.fetch_physical_topology(session_c)
+        if topology_data is not None:
+            cache.put("topology", backend.CC_HOST, topology_data)
+            # Incremental when CC_INCREMENTAL_MAPPING is set
+            cache.put("cc_mapping", backend.CC_HOST,
+                      backend.create_cc_data_mapping(session_c, topology_data=topology_data))
+
+def refresh_snapshot(session_m, session_c, path: str = SNAPSHOT_PATH) -> None:
+    """
+    Refreshes the inventory and stores it to the snapshot file.
+    """
+    refresh_inventory(session_m, session_c)
+    changed = save_snapshot(path)
+    logging.info("Inventory snapshot refreshed, changed entries: %s",
+                 [data_class for data_class, _ in changed])
+
+def refresh_in_background(session_m, session_c,
+                          path: str = SNAPSHOT_PATH) -> threading.Thread:
+    """
+    Refreshes the inventory and the snapshot file in a background thread.
+    """
+    thread = threading.Thread(target=refresh_snapshot, args=(session_m, session_c, path),
+                              name="inventory-refresh", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,140 @@
+"""
+Registry of authenticated API clients shared by backend.py and the way3
+testcases. One DNACenterAPI client is kept per Catalyst Center and user, and
+one DashboardAPI client per Meraki API key, so that every caller reuses the
+same token and the same HTTP keep-alive connections instead of paying a new
+TLS handshake and token exchange. The connection pools are sized for the
+parallel requests of the collectors, and Catalyst Center tokens are renewed
+in the background before they expire.
+"""
+import os
+import time
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from dnacentersdk import DNACenterAPI
+from dnacentersdk.exceptions import ApiError
+from meraki import DashboardAPI
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16")) # Keep-alive connections per host
+CC_TOKEN_LIFETIME = 60 * 60 # Catalyst Center tokens are valid for one hour
+CC_TOKEN_REFRESH_MARGIN = 5 * 60 # Renew tokens this many seconds before they expire
+
+
+def size_connection_pool(client, pool_size: int = HTTP_POOL_SIZE) -> None:
+    """
+    Mounts an HTTP adapter with pool_size keep-alive connections on the
+    requests session of an SDK client (both SDKs keep it in _session._req_session).
+    """
+    http_session = getattr(getattr(client, "_session", None), "_req_session", None)
+    if isinstance(http_session, requests.Session):
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        http_session.mount("https://", adapter)
+        http_session.mount("http://", adapter)
+
+
+class SessionRegistry:
+    """
+    Thread safe cache of API clients, keyed by controller and credentials.
+    """
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE):
+        self.pool_size = pool_size
+        self._clients = {}
+        self._token_times = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def catalyst_center(self, base_url: str, username: str, password: str,
+                        verify: bool = False) -> DNACenterAPI:
+        """
+        Returns the Catalyst Center client of the controller and user,
+        creating and authenticating it on first use.
+        """
+        key = ("cc", base_url, username, password)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = DNACenterAPI(
+                    base_url=base_url,
+                    username=username,
+                    password=password,
+                    verify=verify,
+                )
+                size_connection_pool(client, self.pool_size)
+                self._clients[key] = client
+                self._token_times[key] = time.monotonic()
+                self._start_refresher()
+        return client
+
+    def meraki(self, api_key: str) -> DashboardAPI:
+        """
+        Returns the Meraki Dashboard client of the API key. API keys don't
+        expire, so the client is only created once.
+        """
+        key = ("meraki", api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = DashboardAPI(api_key, print_console=False, output_log=False)
+                size_connection_pool(client, self.pool_size)
+                self._clients[key] = client
+        return client
+
+    def refresh_expiring_tokens(self) -> None:
+        """
+        Renews the Catalyst Center tokens that expire within the refresh margin.
+        """
+        renew_before = time.monotonic() - (CC_TOKEN_LIFETIME - CC_TOKEN_REFRESH_MARGIN)
+        with self._lock:
+            expiring = [key for key, token_time in self._token_times.items()
+                        if token_time <= renew_before]
+        for key in expiring:
+            try:
+                self._clients[key]._session.refresh_token()
+            except (requests.exceptions.RequestException, AttributeError, ApiError) as e:
+                logging.error("Failed to renew Catalyst Center token of %s: %s", key[1], e)
+                continue
+            with self._lock:
+                self._token_times[key] = time.monotonic()
+            logging.info("Renewed Catalyst Center token of %s", key[1])
+
+    def _start_refresher(self) -> None:
+        """
+        Starts the background thread that renews the tokens, once.
+        """
+        if self._refresher is not None:
+            return
+
+        def refresh():
+            while True:
+                time.sleep(60)
+                self.refresh_expiring_tokens()
+
+        self._refresher = threading.Thread(target=refresh, name="token-refresh", daemon=True)
+        self._refresher.start()
+
+    def clear(self) -> None:
+        """
+        Forgets all clients, e.g. after the credentials changed.
+        """
+        with self._lock:
+            self._clients.clear()
+            self._token_times.clear()
+
+
+REGISTRY = SessionRegistry()
+
+def get_cc_session(base_url: str, username: str, password: str,
+                   verify: bool = False) -> DNACenterAPI:
+    """
+    Shared Catalyst Center client of the registry.
+    """
+    return REGISTRY.catalyst_center(base_url, username, password, verify)
+
+def get_meraki_session(api_key: str) -> DashboardAPI:
+    """
+    Shared Meraki Dashboard client of the registry.
+    """
+    return REGISTRY.meraki(api_key)
@@ -0,0 +1,164 @@
+"""
+Sharded collection across several Catalyst Center clusters and Meraki
+organizations. The shards are read from a YAML file:
+
+    catalyst_center:
+      - name: dc1
+        host: cc1.example.com
+        username: ${CC1_USERNAME}
+        password: ${CC1_PASSWORD}
+    meraki:
+      - name: nordics
+        org: Meraki Nordics Lab
+        networks: [Cisco Live Energy Mgmt Demo]
+        api_key: ${MERAKI_NORDICS_KEY}
+
+Environment variables in the values are expanded, and missing values default
+to the settings of backend.py. Every shard runs in its own worker process,
+which points the backend to its controller or organization and keeps its own
+session and inventory cache between cycles. The results of all shards are
+merged into one dataset with one timestamp. A shard that doesn't finish
+within SHARD_TIMEOUT is left out of the cycle instead of delaying the others.
+"""
+import os
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import yaml
+
+import backend
+
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", "50")) # Seconds to wait for the shards of a cycle
+
+# Shard of the worker process, set by init_shard
+SHARD = None
+SHARD_SESSION = None
+
+
+def load_shards(path: str) -> list:
+    """
+    Reads the shards from the YAML file. Returns a list of shard dictionaries
+    with the platform ("cc" or "meraki") and the settings of the shard.
+    """
+    with open(path, encoding="utf-8") as file:
+        config = yaml.safe_load(file) or {}
+
+    def value(item, key, default):
+        return os.path.expandvars(str(item[key])) if item.get(key) is not None else default
+
+    shards = []
+    for item in config.get("catalyst_center") or []:
+        shards.append({
+            "platform": "cc",
+            "name": item.get("name") or item["host"],
+            "host": value(item, "host", backend.CC_HOST),
+            "username": value(item, "username", backend.CC_USERNAME),
+            "password": value(item, "password", backend.CC_PASSWORD),
+        })
+    for item in config.get("meraki") or []:
+        shards.append({
+            "platform": "meraki",
+            "name": item.get("name") or item["org"],
+            "org": value(item, "org", backend.ORG),
+            "networks": item.get("networks") or backend.NETWORKS,
+            "api_key": value(item, "api_key", backend.MERAKI_KEY),
+        })
+    return shards
+
+def init_shard(shard: dict) -> None:
+    """
+    Initializer of a worker process: points the backend to the controller or
+    organization of the shard and opens the session of the shard.
+    """
+    global SHARD, SHARD_SESSION
+    SHARD = shard
+    if shard["platform"] == "cc":
+        backend.CC_HOST = shard["host"]
+        backend.CC_USERNAME = shard["username"]
+        backend.CC_PASSWORD = shard["password"]
+        SHARD_SESSION = backend.initiate_cc_session()
+    else:
+        backend.MERAKI_KEY = shard["api_key"]
+        backend.ORG = shard["org"]
+        backend.NETWORKS = list(shard["networks"])
+        SHARD_SESSION = backend.initiate_meraki_session()
+
+def collect_shard() -> list:
+    """
+    Collects the dataset of the shard of the worker process.
+    """
+    if SHARD_SESSION is None:
+        logging.error("No session for shard %s", SHARD["name"])
+        return []
+    if SHARD["platform"] == "cc":
+        return backend.build_cc_dataset(SHARD_SESSION)
+    return list(backend.build_meraki_dataset(SHARD_SESSION))
+
+
+class ShardedCollector:
+    """
+    Runs the collection of every shard in its own worker process.
+    """
+    def __init__(self, shards: list, timeout: float = SHARD_TIMEOUT):
+        self.shards = shards
+        self.timeout = timeout
+        self.executors = [self.start_worker(shard) for shard in shards]
+        self.futures = [None] * len(shards)
+
+    @staticmethod
+    def start_worker(shard: dict) -> ProcessPoolExecutor:
+        """
+        Starts the worker process of a shard. The worker is spawned instead of
+        forked: the collector already runs the scheduler, job and storage
+        writer threads, and a forked child can deadlock on locks (e.g. of
+        logging) that those threads held at the time of the fork.
+        """
+        return ProcessPoolExecutor(max_workers=1, initializer=init_shard, initargs=(shard,),
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+    def collect(self) -> list:
+        """
+        Collects all shards in parallel and returns their rows in the same
+        format as way1.combined_dataset, with one timestamp. A shard that is
+        still running from the previous cycle is not started again.
+        """
+        for position, future in enumerate(self.futures):
+            if future is None or future.done():
+                self.futures[position] = self.executors[position].submit(collect_shard)
+        wait(self.futures, timeout=self.timeout)
+        timestamp = time.time()
+
+        logging.info("Timestamp of when the data was collected: %s", timestamp)
+
+        dataset = {"cc": [], "meraki": []}
+        for position, (shard, future) in enumerate(zip(self.shards, self.futures)):
+            if not future.done():
+                logging.warning("Shard %s is still running, left out of this cycle",
+                                shard["name"])
+                continue
+            self.futures[position] = None
+            try:
+                rows = future.result()
+            except BrokenProcessPool as e:
+                logging.error("Worker of shard %s died, restarting it: %s", shard["name"], e)
+                self.executors[position] = self.start_worker(shard)
+                continue
+            except Exception as e: # A failing shard must not stop the other shards
+                logging.error("Failed to collect shard %s: %s", shard["name"], e)
+                continue
+            for row in rows:
+                row["timestamp"] = timestamp
+            dataset[shard["platform"]].extend(rows)
+            logging.info("Shard %s: %s rows", shard["name"], len(rows))
+
+        return [dataset]
+
+    def close(self) -> None:
+        """
+        Stops the worker processes.
+        """
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,377 @@
+"""
+Storage backends for the PoE time series collected by way1.py and for the
+port database of Way2.py.
+Every time series backend has a write(rows) method that takes rows in the order
+of TIMESERIES_COLUMNS, so way1.update_and_save_dataset can save to any of them,
+and a close() method that is called when the collector shuts down.
+"""
+import os
+import glob
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Parquet storage is optional
+    pa = pq = None
+
+TIMESERIES_COLUMNS = [
+    "platform",
+    "timestamp",
+    "sw_name",
+    "sw_identifier",
+    "powerinw",
+    "port",
+    "ap_name",
+    "ap_identifier",
+]
+
+PORT_COLUMNS = [
+    "platform",
+    "sw_name",
+    "sw_identifier",
+    "port",
+    "port_name",
+    "ap_name",
+    "ap_identifier",
+]
+
+
+def as_float(value) -> float:
+    """
+    Converts a reading to float. Missing and non-numeric readings are None.
+    """
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """
+    Opens an SQLite database in WAL mode, so readers don't block the writer.
+    """
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class CsvStorage:
+    """
+    Appends the readings to a single CSV file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, rows: list) -> None:
+        """
+        Appends rows to the CSV file, adding headers if the file is new or empty.
+        """
+        df = pd.DataFrame(rows, columns=TIMESERIES_COLUMNS)
+        header = not os.path.exists(self.path) or os.stat(self.path).st_size == 0
+        df.to_csv(self.path, mode="a", header=header, index=False)
+
+    def close(self) -> None:
+        """
+        Every write is a complete append, so there is nothing to flush.
+        """
+
+
+class ParquetStorage:
+    """
+    Columnar storage of the readings in a Parquet dataset partitioned by day:
+    <root>/date=YYYY-MM-DD/part-<ns>.parquet. Switch, port and AP names are
+    dictionary encoded and the power is stored as float32. Every write adds a
+    small file to the partition of the day, and compact() merges the files of a
+    day into one file with large row groups.
+    """
+    ROW_GROUP_SIZE = 128 * 1024
+
+    def __init__(self, root: str):
+        if pa is None:
+            raise ImportError("Parquet storage requires pyarrow: pip install pyarrow")
+        self.root = root
+        self.schema = pa.schema([
+            ("platform", pa.dictionary(pa.int8(), pa.string())),
+            ("timestamp", pa.float64()),
+            ("sw_name", pa.dictionary(pa.int32(), pa.string())),
+            ("sw_identifier", pa.dictionary(pa.int32(), pa.string())),
+            ("powerinw", pa.float32()),
+            ("port", pa.dictionary(pa.int32(), pa.string())),
+            ("ap_name", pa.dictionary(pa.int32(), pa.string())),
+            ("ap_identifier", pa.dictionary(pa.int32(), pa.string())),
+        ])
+
+    def partition_path(self, day: str) -> str:
+        """
+        Directory of the partition of a day (YYYY-MM-DD).
+        """
+        return os.path.join(self.root, f"date={day}")
+
+    def to_table(self, rows: list) -> "pa.Table":
+        """
+        Converts rows to an Arrow table with the storage schema.
+        """
+        columns = list(zip(*rows))
+        arrays = []
+        for field, values in zip(self.schema, columns):
+            if pa.types.is_dictionary(field.type):
+                values = [None if value is None else str(value) for value in values]
+                array = pa.array(values, type=pa.string()).dictionary_encode()
+                arrays.append(array.cast(field.type))
+            else:
+                # Catalyst Center reports the power drawn as a string
+                arrays.append(pa.array([as_float(value) for value in values], type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def write(self, rows: list) -> None:
+        """
+        Writes rows to the partitions of the days of their timestamps.
+        """
+        rows_per_day = {}
+        for row in rows:
+            day = datetime.fromtimestamp(row[1], tz=timezone.utc).strftime("%Y-%m-%d")
+            rows_per_day.setdefault(day, []).append(row)
+
+        for day, day_rows in rows_per_day.items():
+            partition = self.partition_path(day)
+            os.makedirs(partition, exist_ok=True)
+            pq.write_table(
+                self.to_table(day_rows),
+                os.path.join(partition, f"part-{time.time_ns()}.parquet"),
+                compression="zstd",
+            )
+
+    def read_day(self, day: str) -> pd.DataFrame:
+        """
+        Loads the readings of a single day (YYYY-MM-DD) without touching other days.
+        """
+        files = sorted(glob.glob(os.path.join(self.partition_path(day), "*.parquet")))
+        if not files:
+            return pd.DataFrame(columns=TIMESERIES_COLUMNS)
+        return pa.concat_tables(
+            [pq.read_table(file, schema=self.schema) for file in files]
+        ).to_pandas()
+
+    def compact(self, day: str) -> None:
+        """
+        Merges all files of a day into one file, sorted by timestamp.
+        The old files are removed only after the new file is in place.
+        """
+        partition = self.partition_path(day)
+        files = sorted(glob.glob(os.path.join(partition, "part-*.parquet")))
+        if len(files) < 2:
+            return
+        table = pa.concat_tables([pq.read_table(file, schema=self.schema) for file in files])
+        table = table.sort_by("timestamp").unify_dictionaries().combine_chunks()
+
+        temp_path = os.path.join(partition, "compacted.tmp")
+        pq.write_table(table, temp_path, compression="zstd",
+                       row_group_size=self.ROW_GROUP_SIZE)
+        os.replace(temp_path, os.path.join(partition, f"part-{time.time_ns()}.parquet"))
+        for file in files:
+            os.remove(file)
+        logging.info("Compacted %s files of %s", len(files), day)
+
+    def compact_all(self) -> None:
+        """
+        Compaction job: compacts the partitions of all days before today.
+        """
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        for partition in sorted(glob.glob(os.path.join(self.root, "date=*"))):
+            day = os.path.basename(partition)[len("date="):]
+            if day < today:
+                self.compact(day)
+
+    def close(self) -> None:
+        """
+        Every write is a complete file, so there is nothing to flush.
+        """
+
+
+class SqliteStorage:
+    """
+    Stores the readings in an embedded SQLite database. Every cycle is written
+    in one transaction. The (platform, sw_identifier, timestamp) index serves
+    time range queries on a switch, and the (platform, sw_identifier, port,
+    timestamp) index the same queries on a single port.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = connect_sqlite(path)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS readings (
+                    platform TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    sw_name TEXT,
+                    sw_identifier TEXT,
+                    powerinw REAL,
+                    port TEXT,
+                    ap_name TEXT,
+                    ap_identifier TEXT
+                )"""
+            )
+            self.connection.execute(
+                """CREATE INDEX IF NOT EXISTS readings_by_port
+                ON readings (platform, sw_identifier, port, timestamp)"""
+            )
+            self.connection.execute(
+                """CREATE INDEX IF NOT EXISTS readings_by_switch
+                ON readings (platform, sw_identifier, timestamp)"""
+            )
+
+    def write(self, rows: list) -> None:
+        """
+        Inserts rows with one batched statement in a single transaction.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def query_power(self, platform: str, sw_identifier: str, since: float,
+                    until: float = None, port: str = None) -> pd.DataFrame:
+        """
+        Readings of a switch, or of one port of it, between two timestamps, e.g.
+        the power on switch X during the last hour:
+        query_power("meraki", "Q2HP-...", time.time() - 3600)
+        """
+        query = "SELECT * FROM readings WHERE platform = ? AND sw_identifier = ?"
+        params = [platform, sw_identifier]
+        if port is not None:
+            query += " AND port = ?"
+            params.append(port)
+        query += " AND timestamp BETWEEN ? AND ? ORDER BY port, timestamp"
+        params += [since, until or time.time()]
+        return pd.read_sql_query(query, self.connection, params=params)
+
+    def close(self) -> None:
+        """
+        Closes the database, which checkpoints the write-ahead log.
+        """
+        self.connection.close()
+
+
+class SqlitePortDatabase:
+    """
+    Port database of Way2.py in SQLite. Ports are upserted on their platform,
+    switch and port id, so repeated create runs update the ports instead of
+    duplicating them.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = connect_sqlite(path)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS ports (
+                    platform TEXT NOT NULL,
+                    sw_name TEXT,
+                    sw_identifier TEXT,
+                    port TEXT NOT NULL,
+                    port_name TEXT,
+                    ap_name TEXT,
+                    ap_identifier TEXT,
+                    PRIMARY KEY (platform, sw_identifier, port)
+                )"""
+            )
+
+    def upsert(self, rows: list) -> None:
+        """
+        Inserts or updates port rows (dictionaries with the PORT_COLUMNS keys).
+        """
+        with self.connection:
+            self.connection.executemany(
+                """INSERT INTO ports VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (platform, sw_identifier, port) DO UPDATE SET
+                    sw_name = excluded.sw_name,
+                    port_name = excluded.port_name,
+                    ap_name = excluded.ap_name,
+                    ap_identifier = excluded.ap_identifier""",
+                [[None if row[column] is None else str(row[column])
+                  for column in PORT_COLUMNS] for row in rows],
+            )
+
+    def read(self) -> pd.DataFrame:
+        """
+        All ports of the database.
+        """
+        return pd.read_sql_query(
+            f"SELECT {', '.join(PORT_COLUMNS)} FROM ports", self.connection
+        )
+
+
+class QueuedStorage:
+    """
+    Shared write queue in front of a storage backend. Collectors of several
+    platforms call write() from their own threads without waiting for each
+    other, and one writer thread saves the queued rows in order. Rows that
+    are queued at the same time are saved with one write.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write_queued, name="storage-writer",
+                                       daemon=True)
+        self.thread.start()
+
+    def write(self, rows: list) -> None:
+        """
+        Queues rows for the writer thread. Raises RuntimeError if the writer
+        thread is no longer running, so rows are never queued without being saved.
+        """
+        if not self.thread.is_alive():
+            raise RuntimeError("The storage writer thread is not running")
+        self.queue.put(list(rows))
+
+    def _write_queued(self) -> None:
+        """
+        Writer thread: saves the queued rows until close() queues None.
+        """
+        closed = False
+        while not closed:
+            rows = self.queue.get()
+            closed = rows is None
+            batch = rows or []
+            # Merge everything that is already waiting into the same write
+            while not self.queue.empty():
+                rows = self.queue.get()
+                closed = closed or rows is None
+                batch.extend(rows or [])
+            if batch:
+                try:
+                    self.storage.write(batch)
+                except Exception: # A failed write must not stop the writer thread
+                    logging.exception("Failed to write %s rows to storage", len(batch))
+
+    def close(self) -> None:
+        """
+        Writes the rows that are still queued and closes the storage.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.storage.close()
+
+
+def is_sqlite_path(path: str) -> bool:
+    """
+    SQLite databases are recognised by their file extension.
+    """
+    return path.endswith((".db", ".sqlite", ".sqlite3"))
+
+def create_storage(kind: str, path: str):
+    """
+    Returns the storage backend of the given kind ("csv", "parquet" or "sqlite").
+    """
+    if kind == "parquet":
+        return ParquetStorage(path)
+    if kind == "sqlite":
+        return SqliteStorage(path)
+    return CsvStorage(path)
@@ -26,9 +26,8 @@ import os
 import sys
 import time
 import logging
-from typing import List, Dict
-import pandas as pd
-import schedule
+import argparse
+from typing import List, Dict, Iterable, Iterator
 
 from pprint import pprint
 
@@ -38,7 +37,19 @@ sys.path.append(dir_path)
 from backend import (build_meraki_dataset, 
                      initiate_meraki_session, 
                      initiate_cc_session,
-                     build_cc_dataset)
+                     build_cc_dataset,
+                     INVENTORY_CACHE,
+                     NETWORKS)
+from async_collector import combined_dataset_async
+import inventory_snapshot
+from collector_daemon import CollectorDaemon, OVERLAP_POLICIES
+from sharded_collector import ShardedCollector, load_shards
+from storage import CsvStorage, ParquetStorage, QueuedStorage, create_storage
+
+WRITE_CHUNK_ROWS = 10000 # Rows written to the database at a time
+COLLECTION_INTERVAL = 60 # Seconds between collection cycles, on full minutes
+INVENTORY_REFRESH_INTERVAL = 15 * 60
+COMPACTION_TIME = 15 * 60 # Daily compaction at 00:15 UTC
 
 # Configure logging
 logging.basicConfig(
@@ -53,97 +64,216 @@ def combined_dataset(session_m, session_c) -> List[Dict]:
     logging.info("Building dataset in way1.py initiated")
 
     # Data to collect
-    meraki_dataset = build_meraki_dataset(session_m)
     cc_dataset = build_cc_dataset(session_c)
     timestamp = time.time()
 
     logging.info("Timestamp of when the data was collected: %s", timestamp)
 
-    for item in meraki_dataset:
-        item["timestamp"] = timestamp
     for item in cc_dataset:
         item["timestamp"] = timestamp
 
+    # The Meraki rows are streamed from the generator while they are written
+    meraki_dataset = add_timestamp(build_meraki_dataset(session_m), timestamp)
+
     return [{"cc": cc_dataset, "meraki": meraki_dataset}]
 
 
-def create_dataframe(data: List[Dict], columns: List[str]) -> pd.DataFrame:
+def add_timestamp(dataset: Iterable[Dict], timestamp: float) -> Iterator[Dict]:
+    """
+    Adds the collection timestamp to every row of a dataset while it is iterated.
+    """
+    for item in dataset:
+        item["timestamp"] = timestamp
+        yield item
+
+
+PLATFORM_NAMES = {"cc": "catalyst center", "meraki": "meraki"}
+
+
+def storage_rows(platform_name: str, datasets: Iterable[Dict]) -> Iterator[list]:
     """
-    Creates a DataFrame from the given data with specified columns.
+    Converts the dataset rows of a platform to rows in the storage column order.
     """
-    df = pd.DataFrame(data, columns=columns)
-    return df
+    for dataset in datasets:
+        yield [
+            platform_name,
+            dataset.get("timestamp"),
+            dataset.get("sw_name"),
+            dataset.get("sw_serial"),
+            dataset.get("power_in_w"),
+            dataset.get("port_id"),
+            dataset.get("ap_name"),
+            dataset.get("ap_serial"),
+        ]
 
 
-def append_to_csv(df: pd.DataFrame, path: str) -> None:
+def save_rows(storage, rows: Iterable[list]) -> int:
     """
-    Appends a DataFrame to a CSV file, adding headers if the file is new or empty.
+    Writes rows to the storage in chunks, so that large datasets are never
+    held in memory. Returns the number of rows saved.
     """
-    header = not os.path.exists(path) or os.stat(path).st_size == 0
-    df.to_csv(path, mode="a", header=header, index=False)
+    data_to_save = []
+    rows_saved = 0
+    for row in rows:
+        data_to_save.append(row)
+        if len(data_to_save) >= WRITE_CHUNK_ROWS:
+            storage.write(data_to_save)
+            rows_saved += len(data_to_save)
+            data_to_save = []
+    if data_to_save:
+        storage.write(data_to_save)
+        rows_saved += len(data_to_save)
+    return rows_saved
 
 
-def update_and_save_dataset(session_m, session_c, path: str) -> None:
+def update_and_save_dataset(session_m, session_c, storage, use_async: bool = False) -> None:
     """
-    Collects the combined data and updates the csv file.
+    Collects the combined data and saves it to the storage backend.
+    A path instead of a storage backend saves to a csv file.
+    With use_async the platforms are collected at the same time by the asyncio engine.
     """
     logging.info("Inside update-and-save-dataset")
-    dataset_all = combined_dataset(session_m, session_c)
+    if isinstance(storage, str):
+        storage = CsvStorage(storage)
+    if use_async:
+        dataset_all = combined_dataset_async()
+    else:
+        dataset_all = combined_dataset(session_m, session_c)
 
+    save_dataset(storage, dataset_all)
+    logging.info("Inventory cache: %s", INVENTORY_CACHE.stats())
 
-    columns = [
-        "platform",
-        "timestamp",
-        "sw_name",
-        "sw_identifier",
-        "powerinw",
-        "port",
-        "ap_name",
-        "ap_identifier",
-    ]
 
-    data_to_save = []
+def save_dataset(storage, dataset_all: List[Dict]) -> int:
+    """
+    Saves a combined dataset ([{"cc": rows, "meraki": rows}]) to the storage
+    backend. Returns the number of rows saved.
+    """
+    rows_saved = 0
     for platform in dataset_all:
         for key, datasets in platform.items():
-            platform_name = {"cc": "catalyst center", "meraki": "meraki"}.get(key)
+            platform_name = PLATFORM_NAMES.get(key)
             if platform_name:
-                for dataset in datasets:
-
-                    data_to_save.append(
-                        [
-                            platform_name,
-                            dataset.get("timestamp"),
-                            dataset.get("sw_name"),
-                            dataset.get("sw_serial"),
-                            dataset.get("power_in_w"),
-                            dataset.get("port_id"),
-                            dataset.get("ap_name"),
-                            dataset.get("ap_serial"),
-                        ]
-                    )
-    if data_to_save:
-        df = create_dataframe(data_to_save, columns)
-        append_to_csv(df, path)
+                rows_saved += save_rows(storage, storage_rows(platform_name, datasets))
+    if rows_saved:
         logging.info("Database updated")
     else:
         print("Error. No data to update.")
+    return rows_saved
 
 
-def main(path: str) -> None:
+def update_and_save_sharded(collector: ShardedCollector, storage) -> None:
     """
-    Main function handling time scheduling
+    Collects all shards of the sharded collector and saves the merged dataset.
     """
-    meraki_dashboard_session = initiate_meraki_session()
-    catalystcenter_session = initiate_cc_session()
-    update_and_save_dataset(meraki_dashboard_session, catalystcenter_session, path)
+    save_dataset(storage, collector.collect())
+
 
-    schedule.every(1).minute.do(update_and_save_dataset,meraki_dashboard_session, catalystcenter_session,path)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+def update_and_save_platform(platform: str, session, storage, networks: list = None) -> None:
+    """
+    Collects the data of one platform ("cc" or "meraki") with its own timestamp
+    and saves it to the storage backend. For Meraki the collection can be limited
+    to a shard of the networks.
+    """
+    if platform == "cc":
+        dataset = build_cc_dataset(session)
+    else:
+        dataset = build_meraki_dataset(session, networks)
+    timestamp = time.time()
+    rows_saved = save_rows(
+        storage, storage_rows(PLATFORM_NAMES[platform], add_timestamp(dataset, timestamp))
+    )
+    if rows_saved:
+        logging.info("Database updated with %s %s rows of %s",
+                     rows_saved, PLATFORM_NAMES[platform], timestamp)
+    else:
+        logging.error("No %s data to update", PLATFORM_NAMES[platform])
+
+
+def main(path: str, use_async: bool = False, storage_kind: str = "csv",
+         interval: float = COLLECTION_INTERVAL, overlap: str = "skip",
+         cc_interval: float = None, meraki_interval: float = None,
+         jitter: float = 0.0, shard_networks: bool = False, shards_path: str = None) -> None:
+    """
+    Main function running the collector daemon until SIGTERM or Ctrl+C.
+    Catalyst Center and Meraki are collected by separate jobs, each with its
+    own interval (interval by default), optionally with one Meraki job per
+    network. All jobs save through one write queue. With a shards file every
+    controller and organization of the file is collected in its own process.
+    """
+    storage = QueuedStorage(create_storage(storage_kind, path))
+
+    # Start from the inventory snapshot and refresh it without blocking the first cycle
+    inventory_snapshot.load_snapshot()
+    daemon = CollectorDaemon()
+    if shards_path:
+        collector = ShardedCollector(load_shards(shards_path))
+        daemon.add_job("sharded collection", interval, update_and_save_sharded,
+                       collector, storage, overlap=overlap, run_immediately=True)
+        daemon.on_shutdown(collector.close)
+    elif use_async:
+        # The asyncio engine opens its own sessions for every cycle
+        daemon.add_job("collection", interval, update_and_save_dataset, None, None, storage,
+                       use_async, overlap=overlap, run_immediately=True, jitter=jitter)
+    else:
+        meraki_dashboard_session = initiate_meraki_session()
+        catalystcenter_session = initiate_cc_session()
+        daemon.add_job("catalyst center", cc_interval or interval, update_and_save_platform,
+                       "cc", catalystcenter_session, storage,
+                       overlap=overlap, run_immediately=True, jitter=jitter)
+        meraki_shards = [[network] for network in NETWORKS] if shard_networks else [None]
+        for networks in meraki_shards:
+            daemon.add_job(f"meraki {networks[0]}" if networks else "meraki",
+                           meraki_interval or interval, update_and_save_platform,
+                           "meraki", meraki_dashboard_session, storage, networks,
+                           overlap=overlap, run_immediately=True, jitter=jitter)
+        daemon.add_job("inventory", INVENTORY_REFRESH_INTERVAL, inventory_snapshot.refresh_snapshot,
+                       meraki_dashboard_session, catalystcenter_session, run_immediately=True)
+    if isinstance(storage.storage, ParquetStorage):
+        # Compaction job merging the small per-minute files of the previous days
+        daemon.add_job("compaction", 24 * 3600, storage.storage.compact_all,
+                       offset=COMPACTION_TIME)
+    # Flushes the write queue once the last cycles are done
+    daemon.on_shutdown(storage.close)
+    daemon.install_signal_handlers()
+    daemon.run()
 
 
 if __name__ == "__main__":
-    # State to which file to save the data
-    FILE_PATH = "way1/poe_database_timeseries.csv"
-    main(FILE_PATH)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Collect Meraki and Catalyst Center at the same time with asyncio")
+    parser.add_argument("--storage", choices=("csv", "parquet", "sqlite"), default="csv",
+                        help="Storage backend of the time series")
+    parser.add_argument("--compact", action="store_true",
+                        help="Compact the Parquet time series of the previous days and exit")
+    parser.add_argument("--interval", type=float, default=COLLECTION_INTERVAL,
+                        help="Seconds between collection cycles")
+    parser.add_argument("--overlap", choices=OVERLAP_POLICIES, default="skip",
+                        help="Skip a cycle that is due while the previous one is still "
+                             "running, or coalesce the missed cycles into one")
+    parser.add_argument("--cc-interval", type=float,
+                        help="Seconds between Catalyst Center cycles (default --interval)")
+    parser.add_argument("--meraki-interval", type=float,
+                        help="Seconds between Meraki cycles (default --interval)")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Random delay of up to this many seconds after each boundary")
+    parser.add_argument("--shard-networks", action="store_true",
+                        help="Collect every Meraki network in its own job")
+    parser.add_argument("--shards",
+                        help="YAML file of Catalyst Center clusters and Meraki organizations "
+                             "to collect, each in its own process")
+    args = parser.parse_args()
+
+    # State to which file (csv, sqlite) or directory (parquet) to save the data
+    FILE_PATHS = {
+        "csv": "way1/poe_database_timeseries.csv",
+        "parquet": "way1/poe_database_timeseries",
+        "sqlite": "way1/poe_database_timeseries.db",
+    }
+    if args.compact:
+        ParquetStorage(FILE_PATHS["parquet"]).compact_all()
+    else:
+        main(FILE_PATHS[args.storage], args.use_async, args.storage,
+             args.interval, args.overlap, args.cc_interval, args.meraki_interval,
+             args.jitter, args.shard_networks, args.shards)
@@ -26,6 +26,7 @@ __email__ = "cskoglun@cisco.com"
 import os
 import sys
 from os.path import exists
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 from dotenv import load_dotenv
@@ -33,6 +34,7 @@ import pandas as pd
 from colorama import Fore, Style 
 
 from dnacentersdk.exceptions import ApiError
+from meraki.exceptions import APIError as MerakiAPIError
 
 dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', ''))
 sys.path.append(dir_path)
@@ -42,10 +44,30 @@ from backend import (
     initiate_meraki_session,
     build_meraki_dataset,
     build_cc_dataset,
+    call_with_backoff,
+    task_id_of,
+    wait_for_cc_tasks,
+    port_update_action,
+    run_action_batches,
+    get_cc_admin_states,
+    get_meraki_port_states,
+    TokenBucket,
+    CC_MAX_WORKERS,
+    CC_REQUESTS_PER_SECOND,
+    MERAKI_REQUESTS_PER_SECOND,
 )
+import inventory_snapshot
+from storage import PORT_COLUMNS, SqlitePortDatabase, is_sqlite_path
 
 load_dotenv()
 
+# Port database used by the UP/DOWN actions, a csv file or an SQLite database (.db)
+PORT_DATABASE = os.getenv("PORT_DATABASE", "port_database.csv")
+
+# Parallel port updates per platform with the --parallel option
+CC_WORKERS = CC_MAX_WORKERS
+MERAKI_WORKERS = int(os.getenv("MERAKI_MAX_WORKERS", "5"))
+
 def cc_port_dataset(session_c) -> list:
     """
     Builds a Catalyst Center port dataset.
@@ -66,15 +88,7 @@ def create_and_update_port_database(session_m, session_c, file_path):
 
     ports_dataset = {"cc": cc_ports, "meraki": meraki_ports}
 
-    columns = [
-        "platform",
-        "sw_name",
-        "sw_identifier",
-        "port",
-        "port_name",
-        "ap_name",
-        "ap_identifier",
-    ]
+    columns = PORT_COLUMNS
 
     rows = []
     for key, value in ports_dataset.items():
@@ -92,6 +106,11 @@ def create_and_update_port_database(session_m, session_c, file_path):
 
     combined_df = pd.DataFrame(rows, columns=columns)
 
+    if is_sqlite_path(file_path):
+        # Upsert, so that repeated runs don't duplicate the ports
+        SqlitePortDatabase(file_path).upsert(rows)
+        return combined_df
+
     # Determine if headers should be written
     write_header = not exists(file_path)
 
@@ -100,67 +119,113 @@ def create_and_update_port_database(session_m, session_c, file_path):
 
     return combined_df
 
-def find_interface_name(file_path: str, port_id: str) -> str:
+def read_port_database(file_path: str) -> pd.DataFrame:
     """
-    Finds interface name from port_database.csv that matches the interface id.
+    Reads the whole port database from a csv file or an SQLite database.
     """
-    df = pd.read_csv(file_path)
-    filtered_df = df[df["port"] == port_id]
+    if is_sqlite_path(file_path):
+        return SqlitePortDatabase(file_path).read()
+    return pd.read_csv(file_path, dtype=str)
 
-    # Check if there's at least one match
-    if not filtered_df.empty:
+def port_key(platform: str, sw_identifier, port_id) -> tuple:
+    """
+    Key of a port in the port database index. Meraki port ids ("1", "2", ...)
+    repeat on every switch, so a port is only unique together with its
+    platform and switch.
+    """
+    return (str(platform), str(sw_identifier), str(port_id))
+
+def build_port_index(data: pd.DataFrame) -> dict:
+    """
+    Indexes the port database by (platform, switch identifier, port id), so
+    that every lookup is a dictionary access instead of a new read of the database.
+    """
+    port_index = {}
+    for row in data.to_dict("records"):
         # Assuming the first match is the desired one (in case of multiple matches)
-        return filtered_df.iloc[0]["port_name"]
-    else:
-        return ""  # Return an empty string if no match is found
+        port_index.setdefault(port_key(row["platform"], row["sw_identifier"], row["port"]), row)
+    return port_index
 
-def find_serial(file_path: str, port_id: str):
+def load_port_index(file_path: str) -> dict:
     """
-    Finds interface name from port_database.csv that matches the interface id.
+    Reads the port database once and returns it indexed by port.
     """
-    df = pd.read_csv(file_path)
-    filtered_df = df[df["port"] == port_id]
+    return build_port_index(read_port_database(file_path))
 
-    # Check if there's at least one match
-    if not filtered_df.empty:
-        # Assuming the first match is the desired one (in case of multiple matches)
-        return filtered_df.iloc[0]["sw_identifier"]
-    else:
-        return ""  # Return an empty string if no match is found
+def database_ports(data: pd.DataFrame) -> list:
+    """
+    Lists the ports of the port database as (platform, switch identifier, port id).
+    """
+    ports = []
+    for row in data.to_dict("records"):
+        if "cc" in row["platform"]:
+            ports.append(("cc", row["sw_identifier"], row["port"]))
+        elif "meraki" in row["platform"]:
+            ports.append(("meraki", row["sw_identifier"], row["port"]))
+    return ports
+
+def find_interface_name(port_index: dict, platform: str, sw_identifier, port_id) -> str:
+    """
+    Finds interface name from the port database index that matches the interface id.
+    """
+    row = port_index.get(port_key(platform, sw_identifier, port_id))
+    if row is not None:
+        return row["port_name"]
+    return ""  # Return an empty string if no match is found
 
 def update_interface_status(
-    session_m, session_c, action_arg, platform, interface_uuid
-) -> list:
+    session_m, session_c, action_arg, platform, sw_identifier, interface_uuid,
+    port_index=None, rate_limiter=None
+) -> dict:
     """
-    Function updates switch interface Admin Status and changes its description
+    Function updates switch interface Admin Status and changes its description.
+    sw_identifier is the switch UUID (Catalyst Center) or serial (Meraki) of
+    the port. The port database index is loaded if it's not given. Rate limited
+    calls are retried with backoff. Returns the result of the update as a dictionary.
     """
+    if port_index is None:
+        port_index = load_port_index(PORT_DATABASE)
+
+    result = {"platform": platform, "port": interface_uuid, "status": "skipped", "error": ""}
 
     if action_arg.upper() in ["UP", "DOWN"]:
         if platform.lower() == "cc":
-            interface_name = find_interface_name("port_database.csv", interface_uuid)
+            interface_name = find_interface_name(port_index, platform, sw_identifier, interface_uuid)
+            result["port_name"] = interface_name
             new_status = action_arg.upper()
             payload = {
                 "description": f"Interface status configured to 'Admin {new_status} through API'",
                 "adminStatus": f"{new_status}",
             }
             try:
-                session_c.devices.update_interface_details(
-                    interface_uuid, payload=payload
-                )
-                print(
-                    Fore.GREEN
-                    + f"Catalyst - Port {interface_name} with id {interface_uuid} is updated to {new_status}"
+                response = call_with_backoff(
+                    session_c.devices.update_interface_details,
+                    interface_uuid,
+                    payload=payload,
+                    rate_limiter=rate_limiter,
                 )
+                task_id = task_id_of(response)
+                if task_id is not None:
+                    # The update is applied asynchronously, see confirm_cc_updates
+                    result.update(status="submitted", task_id=task_id, new_status=new_status)
+                else:
+                    print(
+                        Fore.GREEN
+                        + f"Catalyst - Port {interface_name} with id {interface_uuid} is updated to {new_status}"
+                    )
+                    result["status"] = "ok"
 
             except ApiError as e:
                 print(
                     Fore.RED
                     + f"No action as the port {interface_name} is already {new_status}"
                 )
+                result.update(status="failed", error=str(e))
 
         elif platform.lower() == "meraki":
-            serial = find_serial("port_database.csv", interface_uuid)
+            serial = sw_identifier
             port_id = interface_uuid
+            result["port_name"] = f"{serial} port {port_id}"
             if action_arg.upper() == "UP":
                 new_status = True
                 new_status_output = "True"
@@ -170,36 +235,236 @@ def update_interface_status(
             else:
                 print("ERROR")
             try:
-                session_m.switch.updateDeviceSwitchPort(
+                call_with_backoff(
+                    session_m.switch.updateDeviceSwitchPort,
                     serial,
                     port_id,
                     enabled=new_status,
+                    rate_limiter=rate_limiter,
                 )
                 print(
-                    f"Meraki - Port 1 with id 1 has changed status to {new_status_output} MS device"
+                    f"Meraki - Port {port_id} on {serial} has changed status to {new_status_output}"
                 )
-                # TODO missing a function on how to detect if port is already up/down
-                # Need to include functionality separately
+                result["status"] = "ok"
+                # Ports that are already up/down are skipped with --reconcile
 
-            except (requests.exceptions.RequestException, ValueError) as e:
+            except (requests.exceptions.RequestException, ValueError, MerakiAPIError) as e:
                 print(str(e))
+                result.update(status="failed", error=str(e))
         else:
             pass
     else:
         print("Sorry did not understand that")
 
-    return None
+    return result
+
+def update_port(
+    session_m, session_c, action_arg, platform, sw_identifier, port_id, port_index,
+    rate_limiter=None
+) -> dict:
+    """
+    Updates one port of a bulk update. Unexpected errors of the port, e.g. a
+    lost connection, become a failed result instead of aborting the whole run.
+    """
+    try:
+        return update_interface_status(
+            session_m, session_c, action_arg, platform, sw_identifier, port_id,
+            port_index, rate_limiter,
+        )
+    except Exception as e: # A failed port must not stop the other ports
+        print(Fore.RED + f"{platform} - Port {port_id} on {sw_identifier} failed: {e}")
+        port_name = (find_interface_name(port_index, platform, sw_identifier, port_id)
+                     if platform == "cc" else f"{sw_identifier} port {port_id}")
+        return {"platform": platform, "port": port_id, "port_name": port_name,
+                "status": "failed", "error": str(e)}
+
+def reconcile_ports(session_m, session_c, action_arg, ports) -> list:
+    """
+    Compares the desired state with the current admin state of the ports,
+    which is fetched in bulk per switch. ports is a list of (platform, switch
+    identifier, port id). Returns only the ports that need to change. Ports
+    with an unknown current state are kept.
+    """
+    desired_up = action_arg.upper() == "UP"
+    cc_switches = {sw_identifier for platform, sw_identifier, _ in ports if platform == "cc"}
+    meraki_switches = {sw_identifier for platform, sw_identifier, _ in ports
+                       if platform == "meraki"}
+    cc_states = get_cc_admin_states(session_c, list(cc_switches)) if cc_switches else {}
+    meraki_states = (get_meraki_port_states(session_m, list(meraki_switches))
+                     if meraki_switches else {})
+
+    changes = []
+    for platform, sw_identifier, port_id in ports:
+        if platform == "cc":
+            current = cc_states.get(port_id)
+            current_up = None if current not in ("UP", "DOWN") else current == "UP"
+        else:
+            current_up = meraki_states.get((sw_identifier, str(port_id)))
+        if current_up is None or current_up != desired_up:
+            changes.append((platform, sw_identifier, port_id))
+
+    print(
+        Style.RESET_ALL
+        + f"{len(ports) - len(changes)} ports are already {action_arg.upper()}, "
+        + f"{len(changes)} ports to update"
+    )
+    return changes
+
+def update_meraki_ports_batched(session_m, action_arg, ports, synchronous=False) -> list:
+    """
+    Enables or disables Meraki ports with action batches instead of one API
+    call per port. ports is a list of (switch serial, port id). Returns the
+    result of every port.
+    """
+    if not ports:
+        return []
+    enabled = action_arg.upper() == "UP"
+    results = []
+    actions = []
+    for serial, port_id in ports:
+        results.append({
+            "platform": "meraki",
+            "port": port_id,
+            "port_name": f"{serial} port {port_id}",
+            "status": "ok",
+            "error": "",
+        })
+        actions.append(port_update_action(serial, port_id, enabled))
+
+    print(Style.RESET_ALL + f"Updating {len(actions)} Meraki ports with action batches...")
+    errors = run_action_batches(session_m, actions, synchronous=synchronous)
+    for result, error in zip(results, errors):
+        if error is not None:
+            result.update(status="failed", error=error)
+    print_summary(results)
+    return results
+
+def confirm_cc_updates(session_c, results: list) -> list:
+    """
+    Waits for the Catalyst Center tasks of all submitted port updates
+    together and sets the final status of their results.
+    """
+    submitted = [result for result in results if result["status"] == "submitted"]
+    if not submitted:
+        return results
+
+    print(Style.RESET_ALL + f"Waiting for {len(submitted)} Catalyst Center tasks...")
+    errors = wait_for_cc_tasks(session_c, [result["task_id"] for result in submitted])
+    for result in submitted:
+        error = errors.get(result["task_id"])
+        if error is None:
+            print(
+                Fore.GREEN
+                + f"Catalyst - Port {result['port_name']} with id {result['port']} is updated to {result['new_status']}"
+            )
+            result["status"] = "ok"
+        else:
+            print(Fore.RED + f"Catalyst - Port {result['port_name']} was not updated: {error}")
+            result.update(status="failed", error=error)
+    print(Style.RESET_ALL)
+    return results
+
+def print_progress(done: int, total: int, failed: int) -> None:
+    """
+    Prints the progress of a bulk port update.
+    """
+    print(
+        Style.RESET_ALL
+        + f"Progress: {done}/{total} ports ({done * 100 // total} %), {failed} failed"
+    )
+
+def print_summary(results: list) -> None:
+    """
+    Prints a per-port summary of a bulk port update.
+    """
+    succeeded = [result for result in results if result["status"] == "ok"]
+    failed = [result for result in results if result["status"] == "failed"]
+    print(Style.RESET_ALL + f"\n{len(succeeded)} ports updated, {len(failed)} failed")
+    for result in failed:
+        print(
+            Fore.RED
+            + f"  {result['platform']} - {result.get('port_name', '')} ({result['port']}): {result['error']}"
+        )
+    print(Style.RESET_ALL)
+
+def update_interfaces_parallel(
+    session_m, session_c, action_arg, ports, port_index,
+    cc_workers=CC_WORKERS, meraki_workers=MERAKI_WORKERS
+) -> list:
+    """
+    Updates the admin status of many ports in parallel. Each platform has its
+    own worker pool and rate limit. ports is a list of (platform, switch
+    identifier, port id).
+    The Catalyst Center tasks are confirmed after all updates are submitted.
+    Prints the progress while running and a summary at the end, and returns
+    the result of every port.
+    """
+    executors = {
+        "cc": ThreadPoolExecutor(max_workers=cc_workers),
+        "meraki": ThreadPoolExecutor(max_workers=meraki_workers),
+    }
+    rate_limiters = {
+        "cc": TokenBucket(CC_REQUESTS_PER_SECOND),
+        "meraki": TokenBucket(MERAKI_REQUESTS_PER_SECOND),
+    }
+    futures = [
+        executors[platform].submit(
+            update_port,
+            session_m,
+            session_c,
+            action_arg,
+            platform,
+            sw_identifier,
+            port_id,
+            port_index,
+            rate_limiters[platform],
+        )
+        for platform, sw_identifier, port_id in ports
+    ]
+
+    results = []
+    failed = 0
+    progress_step = max(1, len(futures) // 20)
+    for future in as_completed(futures):
+        result = future.result()
+        results.append(result)
+        failed += result["status"] == "failed"
+        if len(results) % progress_step == 0 or len(results) == len(futures):
+            print_progress(len(results), len(futures), failed)
+
+    for executor in executors.values():
+        executor.shutdown()
+
+    confirm_cc_updates(session_c, results)
+    print_summary(results)
+    return results
 
 def main(args: list):
     """
-    Main function to either create a database or update port status
+    Main function to either create a database or update port status.
+    With the --parallel option the ports are updated in parallel. With the
+    --batch option the Meraki ports are updated with action batches, which
+    are synchronous with --sync. With the --reconcile option only the ports
+    that are not already in the desired state are updated.
     """
+    parallel = "--parallel" in args
+    batch = "--batch" in args
+    synchronous = "--sync" in args
+    reconcile = "--reconcile" in args
+    args = [arg for arg in args
+            if arg not in ("--parallel", "--batch", "--sync", "--reconcile")]
+
     meraki_dashboard_session = initiate_meraki_session()
     catalystcenter_session = initiate_cc_session()
 
     if len(args) == 2:
         if "create" in args[0].lower():
             db_name = args[1].lower()
+            # The port database drives the port shutdowns, so it is built from
+            # a freshly fetched inventory, which also updates the snapshot
+            inventory_snapshot.refresh_snapshot(
+                meraki_dashboard_session, catalystcenter_session
+            )
             create_and_update_port_database(
                 meraki_dashboard_session, catalystcenter_session, file_path=db_name
             )
@@ -207,41 +472,51 @@ def main(args: list):
     elif len(args) == 1:
         action = args[0].upper()
         if action in ("UP", "DOWN"):
-            columns = [
-                "platform",
-                "sw_name",
-                "sw_identifier",
-                "port",
-                "port_name",
-                "ap_name",
-                "ap_identifier",
-            ]
-
-            data = pd.read_csv("port_database.csv", names=columns, header=None)
-            platform_list = data["platform"].values.tolist()
-            port_list = data["port"].values.tolist()
-
-            # create mapping dictionary
-            index_to_platform = {}
-
-            # Populate the dictionary during enumeration
-            for index, item in enumerate(platform_list):
-                if "cc" in item:
-                    index_to_platform[index] = "cc"
-                elif "meraki" in item:
-                    index_to_platform[index] = "meraki"
-
-            # Use the dictionary to update interface status
-            for index, value in enumerate(port_list):
-                platform_type = index_to_platform.get(index)
-                if platform_type:
-                    update_interface_status(
+            # The port database is read once and shared by all port updates
+            data = read_port_database(PORT_DATABASE)
+            port_index = build_port_index(data)
+            ports = database_ports(data)
+
+            if reconcile:
+                ports = reconcile_ports(
+                    meraki_dashboard_session,
+                    catalystcenter_session,
+                    action,
+                    ports,
+                )
+
+            if batch:
+                update_meraki_ports_batched(
+                    meraki_dashboard_session,
+                    action,
+                    [(sw_identifier, port_id) for platform_type, sw_identifier, port_id in ports
+                     if platform_type == "meraki"],
+                    synchronous=synchronous,
+                )
+                ports = [port for port in ports if port[0] != "meraki"]
+
+            if parallel:
+                update_interfaces_parallel(
+                    meraki_dashboard_session,
+                    catalystcenter_session,
+                    action,
+                    ports,
+                    port_index,
+                )
+            else:
+                results = [
+                    update_port(
                         meraki_dashboard_session,
                         catalystcenter_session,
                         action,
                         platform_type,
+                        sw_identifier,
                         value,
+                        port_index,
                     )
+                    for platform_type, sw_identifier, value in ports
+                ]
+                confirm_cc_updates(catalystcenter_session, results)
     else:
         print("only one argument!")
     return None
@@ -23,7 +23,7 @@ __author__ = "Juulia Santala"
 __email__ = "jusantal@cisco.com"
 
 import os
-from pyats.easypy import run
+from pyats.easypy import run, Task
 from pyats.topology import loader
 
 import argparse
@@ -58,9 +58,16 @@ MERAKI_PING_DESTINATIONS = (
 
 THOUSANDEYES_URLS = ("ciscolive.com",)
 
+# SLA thresholds in ms, per metric and optionally per URL, agent or percentile
+# (see testcases/sla_evaluation.py)
+THOUSANDEYES_SLA_THRESHOLDS = (
+    {"metric": "totalTime", "threshold": 100},
+)
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-n", "--name", help = "Job name")
+parser.add_argument("--parallel", action="store_true", help = "Run the independent tasks at the same time")
 args = parser.parse_args()
 
 def full_path(testcase_name:str, testcase_folder:str="testcases")->str:
@@ -68,6 +75,39 @@ def full_path(testcase_name:str, testcase_folder:str="testcases")->str:
     test_path = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(test_path, testcase_folder, testcase_name)
 
+def job_tasks() -> list:
+    ''' The tasks of the job as (task id, testscript, testscript arguments) '''
+    return [
+        # CONFIGURATION TESTS
+        ("Catalyst Center interface configuration", 'catalyst_center_config_testcase.py', {
+            "interfaces": IOS_XE_INTERFACES,
+            "device_list": IOS_XE_DEVICES,
+            "cat_creds": CATALYST_CENTER_CREDS,
+        }),
+        ("Meraki interface configuration", 'meraki_config_testcase.py', {
+            "interfaces": MERAKI_INTERFACES,
+            "serials": MERAKI_SWITCHES,
+            "api_key": MERAKI_API_KEY,
+        }),
+        # FUNCTIONAL TESTS
+        ("pyATS ping", 'pyats_ping_testcase.py', {
+            "destinations": IOS_XE_PING_DESTINATIONS,
+            "testbed": loader.load("testbed.yaml"),
+        }),
+        ("Meraki ping", 'meraki_ping_testcase.py', {
+            "destinations": MERAKI_PING_DESTINATIONS,
+            "serials": MERAKI_SWITCHES,
+            "api_key": MERAKI_API_KEY,
+        }),
+        # SLA TESTS
+        ("ThousandEyes total response time", 'thousandeyes_testcase.py', {
+            "url_to_test_list": THOUSANDEYES_URLS,
+            "agent": THOUSANDEYES_AGENT,
+            "token": THOUSANDEYES_API_KEY,
+            "sla_thresholds": THOUSANDEYES_SLA_THRESHOLDS,
+        }),
+    ]
+
 def main(runtime):
 
     # define the job name from CLI argument
@@ -77,61 +117,19 @@ def main(runtime):
     print("* Welcome to the Test-Driven port automator *")
     print(f"* {'  '*21}*\n{'* '*22}*\n")
 
-    # CONFIGURATION TESTS
-    task_id = "Catalyst Center interface configuration"
-    cat_config = run(
-        testscript=full_path('catalyst_center_config_testcase.py'),
-        taskid=task_id,
-        interfaces=IOS_XE_INTERFACES,
-        device_list=IOS_XE_DEVICES,
-        cat_creds = CATALYST_CENTER_CREDS
-    )
-
-    print(message(task_id, cat_config))
-
-    task_id = "Meraki interface configuration"
-    meraki_config = run(
-        testscript=full_path('meraki_config_testcase.py'),
-        taskid=task_id,
-        interfaces=MERAKI_INTERFACES,
-        serials=MERAKI_SWITCHES,
-        api_key=MERAKI_API_KEY
-    )
-
-    print(message(task_id, meraki_config))
-
-    # FUNCTIONAL TESTS
-
-    task_id = "pyATS ping"
-    pyats_ping = run(
-        testscript=full_path('pyats_ping_testcase.py'),
-        taskid=task_id,
-        destinations=IOS_XE_PING_DESTINATIONS,
-        testbed=loader.load("testbed.yaml")
-    )
-
-    print(message(task_id, pyats_ping))
-
-    task_id = "Meraki ping"
-    meraki_ping = run(
-        testscript=full_path('meraki_ping_testcase.py'),
-        taskid=task_id,
-        destinations=MERAKI_PING_DESTINATIONS,
-        serials=MERAKI_SWITCHES,
-        api_key=MERAKI_API_KEY
-    )
-
-    print(message(task_id, meraki_ping))
-
-    # SLA TESTS
-
-    task_id = "ThousandEyes total response time"
-    thousandeyes = run(
-        testscript=full_path('thousandeyes_testcase.py'),
-        taskid=task_id,
-        url_to_test_list=THOUSANDEYES_URLS,
-        agent=THOUSANDEYES_AGENT,
-        token=THOUSANDEYES_API_KEY
-    )
-
-    print(message(task_id, thousandeyes))
+    if args.parallel:
+        # The tests are independent, so all tasks are started at once and the
+        # job takes about as long as the slowest task
+        tasks = [
+            Task(testscript=full_path(testscript), taskid=task_id, runtime=runtime, **arguments)
+            for task_id, testscript, arguments in job_tasks()
+        ]
+        for task in tasks:
+            task.start()
+        for task in tasks:
+            task.wait()
+            print(message(task.taskid, task.result))
+    else:
+        for task_id, testscript, arguments in job_tasks():
+            result = run(testscript=full_path(testscript), taskid=task_id, **arguments)
+            print(message(task_id, result))
@@ -23,8 +23,14 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 __author__ = "Juulia Santala"
 __email__ = "jusantal@cisco.com"
 
+import os
+import sys
 from pyats import aetest
-from dnacentersdk import api 
+
+dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(dir_path)
+
+from sessions import get_cc_session # shared clients, one login per Catalyst Center
 
 class CommonSetup(aetest.CommonSetup):
     '''
@@ -59,7 +65,7 @@ class InterfaceConfigTestcase(aetest.Testcase):
         ) as step:
             try:
 
-                catalyst_center = api.DNACenterAPI(
+                catalyst_center = get_cc_session(
                     base_url=f"https://{cat_creds['url']}",
                     username=cat_creds['username'],
                     password=cat_creds['password'],
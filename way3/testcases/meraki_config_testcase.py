@@ -23,8 +23,14 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 __author__ = "Juulia Santala"
 __email__ = "jusantal@cisco.com"
 
+import os
+import sys
 from pyats import aetest
-import meraki
+
+dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(dir_path)
+
+from sessions import get_meraki_session # shared clients, one per API key
 
 class CommonSetup(aetest.CommonSetup):
     '''
@@ -47,7 +53,7 @@ class InterfaceConfigTestcase(aetest.Testcase):
     def get_device_interface_details(self, steps, device, interfaces, api_key):
         ''' Retrieving interface status from Meraki for the selected device '''
     
-        dashboard = meraki.DashboardAPI(api_key, output_log=False)
+        dashboard = get_meraki_session(api_key)
 
         with  steps.start(
             f" Retrieving interface details for: {device}",
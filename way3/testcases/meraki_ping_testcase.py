@@ -18,8 +18,15 @@ or implied.
 '''
 
 import time
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pyats import aetest
-import meraki
+
+dir_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(dir_path)
+
+from sessions import get_meraki_session # shared clients, one per API key
 
 
 __copyright__ = "Copyright (c) 2024 Cisco and/or its affiliates."
@@ -27,6 +34,43 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 __author__ = "Juulia Santala"
 __email__ = "jusantal@cisco.com"
 
+PING_POLL_INTERVALS = (1, 8) # Min and max seconds between the polls of the ping jobs
+PING_TIMEOUT = 60 # Seconds to wait for all the ping jobs to complete
+PING_POLL_WORKERS = 5 # Ping jobs polled at the same time
+
+def poll_ping_jobs(dashboard, ping_jobs:list, timeout:float=PING_TIMEOUT)->dict:
+    '''
+    Polls all the outstanding ping jobs together until each of them is complete.
+    The wait between the polling rounds starts short and doubles while no job
+    completes. Returns the responses of the finished jobs by ping ID.
+    '''
+    min_interval, max_interval = PING_POLL_INTERVALS
+    interval = min_interval
+    pending = {ping_job["pingId"]: ping_job for ping_job in ping_jobs}
+    responses = {}
+    deadline = time.monotonic() + timeout
+
+    def poll(ping_job):
+        try:
+            return dashboard.devices.getDeviceLiveToolsPing(ping_job['request']['serial'], ping_job['pingId'])
+        except Exception as err:
+            print(f"Polling ping job {ping_job['pingId']} failed: {err}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=PING_POLL_WORKERS) as executor:
+        while pending and time.monotonic() < deadline:
+            time.sleep(interval) # It takes a moment for the metrics to generate
+            polled = list(pending.values())
+            completed = 0
+            for ping_job, response in zip(polled, executor.map(poll, polled)):
+                if response is not None and response["status"] in ("complete", "failed"):
+                    responses[ping_job["pingId"]] = response
+                    del pending[ping_job["pingId"]]
+                    completed += 1
+            print(f"{len(responses)}/{len(ping_jobs)} ping jobs finished")
+            interval = min_interval if completed else min(interval * 2, max_interval)
+    return responses
+
 class CommonSetup(aetest.CommonSetup):
     '''
     Common setup tasks - this class is instantiated only once per testscript.
@@ -38,7 +82,7 @@ class CommonSetup(aetest.CommonSetup):
         '''
         Creating and running the Meraki ping jobs
         '''
-        dashboard = meraki.DashboardAPI(api_key, output_log=False)
+        dashboard = get_meraki_session(api_key)
 
         for serial in serials:
             with steps.start(
@@ -54,6 +98,25 @@ class CommonSetup(aetest.CommonSetup):
                             self.ping_jobs.append(ping_job)
                             step.passed(f'Ping job created for {destination}')
  
+    @aetest.subsection
+    def collecting_ping_results(self, steps, api_key:str):
+        '''
+        Polling all the ping jobs at the same time until every job is finished
+        '''
+        dashboard = get_meraki_session(api_key)
+
+        with steps.start(
+            f"Waiting for {len(self.ping_jobs)} ping jobs", continue_=True
+        ) as step:
+            responses = poll_ping_jobs(dashboard, self.ping_jobs)
+            for ping_job in self.ping_jobs:
+                ping_job["response"] = responses.get(ping_job["pingId"])
+
+            if len(responses) < len(self.ping_jobs):
+                step.failed(f"{len(self.ping_jobs) - len(responses)} ping jobs did not finish in time")
+            else:
+                step.passed("All ping jobs finished")
+
     @aetest.subsection
     def mark_tests_for_looping(self):
         '''
@@ -68,25 +131,18 @@ class PingTestcase(aetest.Testcase):
     '''
 
     @aetest.setup
-    def retrieve_ping_metrics(self, steps, ping_job, api_key):
+    def retrieve_ping_metrics(self, steps, ping_job):
         '''
-        Retrieve the Ping job metrics from Meraki.
+        Retrieve the Ping job metrics collected in the common setup.
         '''
-        dashboard = meraki.DashboardAPI(api_key, output_log=False)
-
         with steps.start(
             f"Retrieving Ping metrics from {ping_job['request']['serial']} to {ping_job['request']['target']}"
         ) as step:
-            for i in range (6):
-                print(f"Trying to retrieve data ({i})...")
-                results = dashboard.devices.getDeviceLiveToolsPing(ping_job['request']['serial'], ping_job['pingId'])
-                if not results["status"] == "complete":
-                    print("Results not available, waiting for 5s...", end="\n\n") # It takes a moment for the metrics to generate
-                    time.sleep(5)
-                else:
-                    self.results = results["results"]
-                    step.passed(f"Ping job results retrieved successfully.")
-            step.failed("Couldn't retrieve Ping job data")
+            response = ping_job.get("response")
+            if response is None or response["status"] != "complete":
+                step.failed("Couldn't retrieve Ping job data")
+            self.results = response["results"]
+            step.passed("Ping job results retrieved successfully.")
 
     @aetest.test
     def ping(self, steps, ping_job):
@@ -0,0 +1,131 @@
+'''
+SLA evaluation of ThousandEyes HTTP server test results.
+
+All results are loaded into one table with a row per URL and agent, and the
+SLA thresholds are applied to the whole table at once. A threshold is a
+dictionary with the metric, the threshold in milliseconds and optionally:
+
+    url        only for this URL (default "*", all URLs)
+    agent      only for this agent ID (default "*", all agents)
+    statistic  "value" checks the result of every agent (default),
+               "p50", "p95" or "p99" checks the percentile over the agents of a URL
+
+The most specific threshold wins: URL and agent, URL, agent, then "*".
+'''
+from itertools import product
+
+import pandas as pd
+
+METRICS = ["totalTime", "connectTime", "dnsTime"]
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+ANY = "*"
+
+# Total time of every result must be below 100 ms unless thresholds are given
+DEFAULT_THRESHOLDS = [{"metric": "totalTime", "threshold": 100}]
+
+def results_frame(test_data_by_url:dict)->pd.DataFrame:
+    '''
+    Loads the results of all tests into one table, one row per URL and agent.
+    test_data_by_url maps every tested URL to its test data, or None.
+    '''
+    rows = []
+    for url, test_data in test_data_by_url.items():
+        if not test_data:
+            continue
+        for result in test_data.get("results") or []:
+            agent = result.get("agent") or {}
+            rows.append({
+                "url": url,
+                "agent": str(agent.get("agentId", result.get("agentId", ""))),
+                "agentName": agent.get("agentName", ""),
+                **{metric: result.get(metric) for metric in METRICS},
+                "errorDetails": result.get("errorDetails", ""),
+            })
+    results = pd.DataFrame(rows, columns=["url", "agent", "agentName", *METRICS, "errorDetails"])
+    results[METRICS] = results[METRICS].astype(float)
+    return results
+
+def thresholds_frame(thresholds:list)->pd.DataFrame:
+    ''' Converts the threshold dictionaries to a table with defaults filled in. '''
+    frame = pd.DataFrame(list(thresholds), columns=["url", "agent", "metric", "statistic", "threshold"])
+    for column, default in (("url", ANY), ("agent", ANY), ("statistic", "value")):
+        frame[column] = frame[column].fillna(default).astype(str)
+    frame["threshold"] = frame["threshold"].astype(float)
+    return frame
+
+def percentile_table(results:pd.DataFrame)->pd.DataFrame:
+    ''' p50, p95 and p99 of every metric over the agents of each URL, in long format. '''
+    quantiles = results.groupby("url")[METRICS].quantile(list(PERCENTILES.values()))
+    quantiles.index = quantiles.index.set_names(["url", "quantile"])
+    table = quantiles.reset_index().melt(
+        id_vars=["url", "quantile"], value_vars=METRICS, var_name="metric", value_name="value"
+    )
+    table["statistic"] = table["quantile"].map({value: name for name, value in PERCENTILES.items()})
+    return table.drop(columns="quantile")
+
+def resolve_thresholds(checks:pd.DataFrame, rules:pd.DataFrame, levels:list)->pd.Series:
+    '''
+    Finds the threshold of every check row. levels lists the key columns
+    from the most to the least specific rule, e.g. ["url", "agent"].
+    '''
+    threshold = pd.Series(float("nan"), index=checks.index)
+    # (True, True), (True, False), (False, True), (False, False) for ["url", "agent"]
+    for specific in product((True, False), repeat=len(levels)):
+        keys = ["metric", "statistic"] + [level for level, used in zip(levels, specific) if used]
+        mask = pd.Series(True, index=rules.index)
+        for level, used in zip(levels, specific):
+            mask &= (rules[level] != ANY) == used
+        level_rules = rules.loc[mask, keys + ["threshold"]].drop_duplicates(keys, keep="last")
+        if level_rules.empty:
+            continue
+        matched = checks[keys].merge(level_rules, on=keys, how="left")["threshold"]
+        threshold = threshold.fillna(pd.Series(matched.to_numpy(), index=checks.index))
+    return threshold
+
+def evaluate_sla(results:pd.DataFrame, thresholds:pd.DataFrame, urls:list=None)->pd.DataFrame:
+    '''
+    Applies the thresholds to the results. Returns one row per check with
+    the URL, agent, metric, statistic, value, threshold, passed and a description,
+    in the order of urls. Every URL of urls without results gets a failed check.
+    '''
+    values = results.melt(
+        id_vars=["url", "agent", "errorDetails"], value_vars=METRICS,
+        var_name="metric", value_name="value"
+    )
+    values["statistic"] = "value"
+    values["threshold"] = resolve_thresholds(values, thresholds, ["url", "agent"])
+
+    percentiles = percentile_table(results)
+    percentiles["agent"] = ANY
+    percentiles["errorDetails"] = ""
+    percentiles["threshold"] = resolve_thresholds(
+        percentiles, thresholds[thresholds["agent"] == ANY], ["url"]
+    )
+
+    checks = pd.concat([values, percentiles], ignore_index=True)
+    checks = checks[checks["threshold"].notna()].reset_index(drop=True)
+    # Missing values (no connectivity) compare as False, so they fail
+    checks["passed"] = checks["value"] < checks["threshold"]
+
+    subject = ("agent " + checks["agent"]).where(checks["statistic"] == "value", checks["statistic"])
+    checks["description"] = (
+        subject + " " + checks["metric"] + " "
+        + checks["value"].round(1).astype(str) + "ms (threshold "
+        + checks["threshold"].astype(str) + "ms)"
+    )
+    no_value = checks["value"].isna()
+    checks.loc[no_value, "description"] = (
+        subject[no_value] + " connectivity issue: " + checks.loc[no_value, "errorDetails"].astype(str)
+    )
+
+    if urls is None:
+        return checks
+    tested_urls = set(results["url"])
+    missing = pd.DataFrame({"url": [url for url in urls if url not in tested_urls]})
+    missing = missing.assign(agent=ANY, errorDetails="", metric="", statistic="", value=float("nan"),
+                             threshold=float("nan"), passed=False,
+                             description="Couldn't retrieve metrics")
+    checks = pd.concat([checks, missing], ignore_index=True)
+    order = {url: position for position, url in enumerate(urls)}
+    return checks.sort_values("url", key=lambda column: column.map(order),
+                              kind="stable").reset_index(drop=True)
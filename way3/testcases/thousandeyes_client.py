@@ -0,0 +1,127 @@
+'''
+ThousandEyes API client for the SLA testcases.
+
+All requests share one pooled HTTP session, the instant tests are created
+concurrently, and the results of all tests are polled together with
+exponential backoff, so that hundreds of URLs can be validated in one sweep.
+Requests that hit the organization rate limit (HTTP 429) are retried.
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# All ThousandEyes API endpoint url starts with this base url
+BASE_URL = "https://api.thousandeyes.com/v7"
+
+MAX_WORKERS = 8 # Parallel requests towards the ThousandEyes API
+POLL_INTERVALS = (2, 30) # Min and max seconds between the polls of the results
+POLL_TIMEOUT = 300 # Seconds to wait for the results of all tests
+MAX_RETRIES = 5 # Retries of a rate limited (HTTP 429) request
+
+def retry_delay(response:requests.Response, attempt:int)->float:
+    '''
+    Seconds to wait before retrying a rate limited response: the Retry-After
+    header, or else the time until the organization rate limit resets
+    (x-organization-rate-limit-reset, epoch seconds), or else exponential backoff.
+    '''
+    try:
+        if "Retry-After" in response.headers:
+            return max(float(response.headers["Retry-After"]), 0)
+        if "x-organization-rate-limit-reset" in response.headers:
+            return max(float(response.headers["x-organization-rate-limit-reset"]) - time.time(), 1)
+    except ValueError:
+        pass
+    return 2 ** attempt
+
+class ThousandEyesClient:
+    ''' Client for the ThousandEyes instant HTTP server tests. '''
+
+    def __init__(self, token:str, max_workers:int=MAX_WORKERS):
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token}"
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+
+    def request(self, method:str, url:str, **kwargs)->requests.Response:
+        ''' Sends a request to the API, retrying rate limited (HTTP 429) responses. '''
+        for attempt in range(MAX_RETRIES + 1):
+            response = self.session.request(method, url, timeout=30, **kwargs)
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            delay = retry_delay(response, attempt)
+            print(f"Rate limited by ThousandEyes, retrying in {delay:.1f} s")
+            time.sleep(delay)
+
+    def create_instant_test(self, url_to_test:str, agents:list)->str:
+        ''' Creates an instant HTTP server test run by the agents, returns the test ID. '''
+        payload = {
+            "agents": [{"agentId": agent} for agent in agents],
+            "url": url_to_test
+        }
+        response = self.request("POST", f"{BASE_URL}/tests/http-server/instant", json=payload)
+        return response.json()["testId"]
+
+    def create_instant_tests(self, url_to_test_list:list, agents:list)->dict:
+        '''
+        Creates the instant tests of all URLs at the same time.
+        Returns a dictionary of URL -> (test ID, error), one of them being None.
+        '''
+        def create(url_to_test):
+            try:
+                return self.create_instant_test(url_to_test, agents), None
+            except (requests.exceptions.RequestException, KeyError, ValueError) as err:
+                return None, str(err)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(url_to_test_list, executor.map(create, url_to_test_list)))
+
+    def get_test_results(self, test_id:str)->dict:
+        ''' Retrieves the current results of an HTTP server test. '''
+        response = self.request("GET", f"{BASE_URL}/test-results/{test_id}/http-server")
+        return response.json()
+
+    def poll_test_results(self, test_ids:list, expected_results:int=1,
+                          timeout:float=POLL_TIMEOUT)->dict:
+        '''
+        Polls the results of all tests together until every test has a result
+        from each of its agents (expected_results). The wait between the polling
+        rounds starts short and doubles while no test completes.
+        Returns the test data of the completed tests by test ID.
+        '''
+        min_interval, max_interval = POLL_INTERVALS
+        interval = min_interval
+        pending = set(test_ids)
+        completed_tests = {}
+        deadline = time.monotonic() + timeout
+
+        def poll(test_id):
+            try:
+                return self.get_test_results(test_id)
+            except (requests.exceptions.RequestException, ValueError) as err:
+                print(f"Polling test {test_id} failed: {err}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending and time.monotonic() < deadline:
+                time.sleep(interval) # It takes a moment for the results to generate
+                polled = list(pending)
+                completed = 0
+                for test_id, data in zip(polled, executor.map(poll, polled)):
+                    if data is not None and len(data.get("results") or []) >= expected_results:
+                        completed_tests[test_id] = data
+                        pending.discard(test_id)
+                        completed += 1
+                print(f"{len(completed_tests)}/{len(test_ids)} ThousandEyes tests completed")
+                interval = min_interval if completed else min(interval * 2, max_interval)
+        return completed_tests
+
+    def close(self):
+        ''' Closes the pooled connections. '''
+        self.session.close()
@@ -1,115 +1,108 @@
-import time
+import os
+import sys
 from pyats import aetest
-import requests
 
-# All ThousandEyes API endpoint url starts with this base url
-BASE_URL = "https://api.thousandeyes.com/v7"
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from thousandeyes_client import ThousandEyesClient
+from sla_evaluation import DEFAULT_THRESHOLDS, results_frame, thresholds_frame, evaluate_sla
 
 class CommonSetup(aetest.CommonSetup):
     '''
     Common setup tasks - this class is instantiated only once per testscript.
     '''
     test_id_list = []
+    test_ids = {}
+    test_data = {}
 
     @aetest.subsection
     def create_TE_instant_tests(self, steps, token, agent, url_to_test_list):
         '''
         Creating and running the ThousandEyes instant tests to check SLA of selected
-        URL list
+        URL list. The tests of all URLs are created at the same time.
         '''
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}"
-        }
-        api_endpoint = f"{BASE_URL}/tests/http-server/instant"
+        self.client = ThousandEyesClient(token)
+        # agent can be one agent ID or a list of agent IDs
+        self.agents = [agent] if isinstance(agent, (str, int)) else list(agent)
 
         with steps.start(
             "Creating ThousandEyes instant tests", continue_=True
             ) as step:
 
-            for url_to_test in url_to_test_list:
-                payload = {
-                    "agents": [{"agentId": agent}],
-                    "url": url_to_test
-                }
-
-                response = requests.post(api_endpoint, headers=headers, json=payload, timeout=30)
-                if response.ok:
-                    test_id = response.json()["testId"]
-                    self.test_id_list.append(test_id)
-                    step.passed()
+            created_tests = self.client.create_instant_tests(url_to_test_list, self.agents)
+            for url_to_test, (test_id, error) in created_tests.items():
+                if test_id is None:
+                    print(f"Creating the test for {url_to_test} failed: {error}")
                 else:
-                    print(response.text)
-                    step.failed()
+                    self.test_id_list.append(test_id)
+                    self.test_ids[url_to_test] = test_id
+
+            if len(self.test_id_list) < len(created_tests):
+                step.failed(f"{len(created_tests) - len(self.test_id_list)} tests were not created")
+            else:
+                step.passed(f"{len(self.test_id_list)} tests created")
 
     @aetest.subsection
-    def mark_tests_for_looping(self):
+    def collect_TE_test_results(self, steps):
         '''
-        Run the PerformanceTestCase with each of the generated instant tests.
-        ThousandEyes creates one test for each of the URLs.
+        Polling the results of all the instant tests at the same time until
+        every test has a result from all of its agents
         '''
-        aetest.loop.mark(PerformanceTestcase, test_id=self.test_id_list)
+        with steps.start(
+            f"Waiting for the results of {len(self.test_id_list)} tests", continue_=True
+            ) as step:
 
-class PerformanceTestcase(aetest.Testcase):
-    ''' Simple Testcase for checking performance of websites. '''
+            results = self.client.poll_test_results(self.test_id_list, expected_results=len(self.agents))
+            self.test_data.update((url, results.get(test_id)) for url, test_id in self.test_ids.items())
+            self.client.close()
 
-    metrics = {}
+            if len(results) < len(self.test_id_list):
+                step.failed(f"{len(self.test_id_list) - len(results)} tests have no results")
+            else:
+                step.passed("Results retrieved for all tests")
 
-    @aetest.setup
-    def retrieve_test_metrics(self, steps, token, test_id):
+    @aetest.subsection
+    def load_TE_results(self, url_to_test_list):
         '''
-        Retrieve the test metrics of the instant test by using ThousandEyes API.
+        Load the results of all the tests into one table for the SLA evaluation.
+        URLs whose test was not created or has no results are loaded without rows.
         '''
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}"
-        }
+        self.test_data.update((url, None) for url in url_to_test_list if url not in self.test_data)
+        self.parent.parameters["sla_results"] = results_frame(self.test_data)
 
+class PerformanceTestcase(aetest.Testcase):
+    ''' Testcase for checking performance of websites against the SLA thresholds. '''
+
+    @aetest.setup
+    def evaluate_sla_thresholds(self, steps, sla_results, url_to_test_list,
+                                sla_thresholds=DEFAULT_THRESHOLDS):
+        '''
+        Apply the SLA thresholds to the results of all URLs and agents at once.
+        URLs without results fail with a check of their own.
+        '''
         with steps.start(
-            "Retrieving ThousandEyes performance metrics", continue_=True
+            "Evaluating the SLA thresholds", continue_=True
             ) as step:
 
-            for i in range (10):
-                print(f"Trying to retrieve data ({i})...")
-                api_endpoint = f"{BASE_URL}/test-results/{test_id}/http-server"
-
-                response = requests.get(api_endpoint, headers=headers, timeout=30)
-
-                data = response.json()
-
-                if not data["results"]:
-                    print("Results are not yet available.")
-                    time.sleep(6)
-
-                else:
-                    self.metrics = {"url_to_test":{data['test']['url']}, "results": data['results'][0]}
-                    step.passed(f"Metric retrieval for test {test_id} successful")
-
-            step.failed(f"Couldn't retrieve metrics for {test_id}")
+            self.checks = evaluate_sla(sla_results, thresholds_frame(sla_thresholds),
+                                       list(url_to_test_list))
+            step.passed(f"{len(self.checks)} checks evaluated for {len(url_to_test_list)} URLs")
 
     @aetest.test
     def performance_test(self, steps):
-        ''' Using the response from ThousandEyes tests, test for the appropriate quality of service. '''
+        ''' Using the evaluated SLA table, report the quality of service of every URL. '''
 
-        with steps.start(
-            f"Validating total time for {self.metrics['url_to_test']}", continue_=True
-        ) as step:
-
-            threshold = 100 # This is the threshold for expected result
-
-            try:
-                total_time = self.metrics["results"]['totalTime']
-                assert total_time < threshold
-
-            except AssertionError: # Threshold is smaller than actual value
-                step.failed(f"Total time {total_time}ms higher than threshold {threshold}ms")
+        for url, url_checks in self.checks.groupby("url", sort=False):
+            failed_checks = url_checks[~url_checks["passed"]]
 
-            except KeyError: # total time is not included in the result - there is no connectivity
-                error = self.metrics["results"]['errorDetails']
-                step.failed(f"Connectivity issue: {error}")
+            with steps.start(
+                f"Validating SLA for {url}", continue_=True
+            ) as step:
 
-            else:
-                step.passed(f"Total time: {total_time}ms")
+                if failed_checks.empty:
+                    step.passed(f"All {len(url_checks)} checks passed")
+                else:
+                    step.failed("; ".join(failed_checks["description"]))
 
     @aetest.cleanup
     def cleanup(self):
@@ -128,10 +121,16 @@ if __name__ == "__main__":
     agent = os.getenv("TE_AGENT")
     # Define the URLs to test
     my_urls = ("ciscolive.com","https://testdrive.sechnik.com")
+    # Define the SLA thresholds in ms, see sla_evaluation.py
+    my_thresholds = (
+        {"metric": "totalTime", "threshold": 100},
+        {"metric": "totalTime", "statistic": "p95", "threshold": 150},
+    )
 
     # Call the test with the api_key, urls that you want to test, and agent you want to use
     sla_test = aetest.main(
                             token=api_key,
                             url_to_test_list = my_urls,
-                            agent = agent
+                            agent = agent,
+                            sla_thresholds = my_thresholds
                         )